@@ -1,3 +1,7 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
 class FlistService:
     def __init__(self, client):
         self.client = client
@@ -22,6 +26,47 @@ class FlistService:
         return self.client.post(uri, data, headers, query_params, content_type)
 
 
+    def flist_meupload_resumable(self, filepath, session=None, workers=4, chunksize=16 << 20, headers=None):
+        """
+        Upload a .tar.gz file in chunks sent in parallel and insert it to the hub
+        An interrupted upload can be resumed by passing its session id, only missing chunks are sent
+        It is method for POST /flist/me/upload/sessions (and related endpoints)
+        """
+        uri = self.client.base_url + "/flist/me/upload/sessions"
+        size = os.path.getsize(filepath)
+
+        if session is None:
+            data = {'filename': os.path.basename(filepath), 'size': size}
+            response = self.client.post(uri, data, headers, None, "application/json")
+            response.raise_for_status()
+            session = response.json()['payload']['id']
+
+        response = self.client.get(uri + "/" + session, None, headers, None, None)
+        response.raise_for_status()
+        status = response.json()['payload']
+
+        chunksize = min(chunksize, status['chunk-size'])
+        missing = missing_ranges(status['ranges'], size, chunksize)
+
+        def upload(chunk):
+            start, end = chunk
+
+            with open(filepath, "rb") as f:
+                f.seek(start)
+                data = f.read(end - start)
+
+            chunkheaders = dict(headers or {})
+            chunkheaders['Content-Range'] = "bytes %d-%d/%d" % (start, end - 1, size)
+
+            response = self.client.session.put(uri + "/" + session, data=data, headers=chunkheaders)
+            response.raise_for_status()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(upload, missing))
+
+        return self.client.post(uri + "/" + session + "/finalize", None, headers, None, None)
+
+
     def flist_meflistlinklinkname_get(self, flist, linkname, headers=None, query_params=None, content_type="application/json"):
         """
         Create a flist link (symlink) updatable
@@ -90,3 +135,42 @@ class FlistService:
         """
         uri = self.client.base_url + "/flist"
         return self.client.get(uri, None, headers, query_params, content_type)
+
+
+    def flist_pages(self, limit=100, headers=None, query_params=None, content_type="application/json"):
+        """
+        Iterate over flists found, one page fetched at a time
+        query_params can filter (prefix, match, repository) and sort (sort, order) results
+        It is method for GET /flist (paginated)
+        """
+        params = dict(query_params or {}, limit=limit)
+
+        while True:
+            response = self.flist_get(headers, params, content_type)
+            response.raise_for_status()
+            page = response.json()
+
+            for item in page['items']:
+                yield item
+
+            if not page['next']:
+                return
+
+            params['cursor'] = page['next']
+
+
+def missing_ranges(received, size, chunksize):
+    """
+    Split ranges not yet received into chunks of at most chunksize bytes
+    """
+    missing = []
+    offset = 0
+
+    for start, end in received + [[size, size]]:
+        while offset < start:
+            missing.append((offset, min(start, offset + chunksize)))
+            offset = missing[-1][1]
+
+        offset = max(offset, end)
+
+    return missing
@@ -19,8 +19,9 @@ dependencies() {
 
     apt-get install -y build-essential git libsnappy-dev libz-dev \
         libtar-dev libb2-dev autoconf libtool libjansson-dev \
-        libhiredis-dev libsqlite3-dev tmux vim \
+        libhiredis-dev libsqlite3-dev tmux vim pigz zstd xz-utils pbzip2 \
         python3-flask python3-redis python3-docker python3-pytoml \
+        python3-gunicorn python3-gevent python3-brotli python3-prometheus-client \
         libssl-dev python3-pip python3-requests python3-nacl
 
     pip3 install python-jose
@@ -100,6 +101,8 @@ set +ex
 echo "================================================"
 echo " - Please edit $1/python/config.py"
 echo " - And then run your hub inside a tmux, with:"
+echo "    cd $1/python && gunicorn3 -c gunicorn.conf.py wsgi:app"
+echo " - Or with the development server:"
 echo "    cd $1/python && python3 flist-uploader.py"
 echo "================================================"
 
@@ -0,0 +1,34 @@
+import os
+from config import config
+
+bind = config.get('listen', "0.0.0.0:5555")
+
+# one greenlet per connection, thousands of events listeners
+# can be kept opened by a single worker, blocking parts of builds
+# (layers extraction, decompression, hashing) are offloaded to
+# gevent native threads (hub.offload)
+worker_class = "gevent"
+worker_connections = config.get('worker-connections', 4096)
+
+# build jobs and in-memory events channels belongs to the worker
+# which created them, more than one worker needs the redis notifier
+# backend ('notifier-backend') to follow jobs from any worker
+workers = config.get('workers', 1)
+
+# application (and its background services) is created inside each
+# worker, after forking
+preload_app = False
+
+# worker is restarted when not responding for that long
+timeout = 300
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+
+# prometheus multi-process mode, metrics of a stopped worker
+# are dropped from live gauges
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
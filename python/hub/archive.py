@@ -0,0 +1,242 @@
+import bz2
+import zlib
+import lzma
+import time
+import shutil
+import subprocess
+import hub.timing
+import hub.offload
+
+try:
+    import zstandard
+
+except ImportError:
+    zstandard = None
+
+#
+# supported compressions, detected from archive first bytes
+#   - magic: compressed stream signature
+#   - decoders: external commands, in preference order (multi-threaded first)
+#   - fallback: python streaming decompressor factory
+#
+formats = {
+    'gzip': {
+        'magic': b'\x1f\x8b',
+        'decoders': [["pigz", "-d", "-c"], ["gzip", "-d", "-c"]],
+        'fallback': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    },
+    'zstd': {
+        'magic': b'\x28\xb5\x2f\xfd',
+        'decoders': [["zstd", "-d", "-c", "-q", "-T0"]],
+        'fallback': (lambda: zstandard.ZstdDecompressor().decompressobj()) if zstandard else None,
+    },
+    'xz': {
+        'magic': b'\xfd7zXZ\x00',
+        'decoders': [["xz", "-d", "-c", "-T0"]],
+        'fallback': lambda: lzma.LZMADecompressor(),
+    },
+    'bzip2': {
+        'magic': b'BZh',
+        'decoders': [["pbzip2", "-d", "-c"], ["lbzip2", "-d", "-c"], ["bzip2", "-d", "-c"]],
+        'fallback': lambda: bz2.BZ2Decompressor(),
+    },
+}
+
+# enough bytes to recognize any signature
+magiclen = max(len(entry['magic']) for entry in formats.values())
+
+# python decompression input size, bounds memory used per step
+blocksize = 64 * 1024
+
+def detect(header):
+    """
+    Compression of an archive starting with `header`, None for
+    a plain (or unknown) archive
+    """
+    for name, entry in formats.items():
+        if header.startswith(entry['magic']):
+            return name
+
+    return None
+
+def decoder(compression):
+    """
+    First external decoder available for `compression`
+    """
+    for command in formats[compression]['decoders']:
+        if shutil.which(command[0]):
+            return command
+
+    return None
+
+class HubStreamDecompressor:
+    """
+    Python decompression of a stream, concatenated streams (pigz,
+    pbzip2 or multi-frames outputs) are supported
+    """
+    def __init__(self, compression):
+        self.magic = formats[compression]['magic']
+        self.factory = formats[compression]['fallback']
+        self.decompressor = self.factory()
+
+        # data following the end of a stream, not (yet) enough
+        # to know if it's another stream
+        self.pending = b""
+
+    def decompress(self, data):
+        output = []
+
+        data = self.pending + data
+        self.pending = b""
+
+        while data:
+            if getattr(self.decompressor, 'eof', False):
+                # next stream signature can be split across writes
+                if len(data) < len(self.magic) and self.magic.startswith(data):
+                    self.pending = data
+                    break
+
+                # trailing data is only another stream or padding
+                if not data.startswith(self.magic):
+                    break
+
+                self.decompressor = self.factory()
+
+            output.append(self.decompressor.decompress(data))
+
+            if not getattr(self.decompressor, 'eof', False):
+                break
+
+            data = self.decompressor.unused_data
+
+        return b"".join(output)
+
+class HubArchiveUnpacker:
+    """
+    Unpack a (compressed) tar archive written by chunks into `target`
+    directory, compression is detected from the first bytes and the
+    archive is decompressed by the fastest decoder available
+    """
+    def __init__(self, target):
+        self.target = target
+        self.header = b""
+        self.started = None
+        self.compression = None
+        self.decoder = None
+        self.decompressor = None
+        self.processes = []
+        self.sink = None
+        self.broken = False
+        self.error = None
+        self.received = 0
+        self.stage = hub.timing.HubStage('unpack')
+
+    def start(self):
+        self.started = time.monotonic()
+        self.compression = detect(self.header)
+
+        tar = ["tar", "-xpf", "-", "-C", self.target]
+
+        if self.compression is None:
+            self.decoder = "tar"
+            self.processes = [subprocess.Popen(tar, stdin=subprocess.PIPE)]
+            self.sink = self.processes[0].stdin
+            return
+
+        command = decoder(self.compression)
+
+        if command is not None:
+            self.decoder = " ".join(command)
+
+            decode = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            untar = subprocess.Popen(tar, stdin=decode.stdout)
+
+            # tar owns the pipe now, it needs to see end of file
+            decode.stdout.close()
+
+            self.processes = [decode, untar]
+            self.sink = decode.stdin
+            return
+
+        if formats[self.compression]['fallback'] is None:
+            self.error = "no decoder available for %s archives" % self.compression
+            print("[-] unpack: %s" % self.error)
+
+            # request body is still consumed, nothing unpacked
+            self.broken = True
+            return
+
+        self.decoder = "python"
+        self.decompressor = HubStreamDecompressor(self.compression)
+        self.processes = [subprocess.Popen(tar, stdin=subprocess.PIPE)]
+        self.sink = self.processes[0].stdin
+
+    def send(self, data):
+        if not data or self.broken:
+            return
+
+        try:
+            self.sink.write(data)
+
+        except BrokenPipeError:
+            self.broken = True
+
+    def forward(self, data):
+        if self.decompressor is None:
+            return self.send(data)
+
+        for offset in range(0, len(data), blocksize):
+            if self.broken:
+                return
+
+            try:
+                self.send(hub.offload.run(self.decompressor.decompress, data[offset:offset + blocksize]))
+
+            except Exception as e:
+                self.error = "could not decompress %s archive: %s" % (self.compression, e)
+                print("[-] unpack: %s" % self.error)
+                self.broken = True
+
+    def write(self, data):
+        length = len(data)
+        self.received += length
+
+        if self.started is None:
+            self.header += data
+
+            if len(self.header) < magiclen:
+                return length
+
+            data = self.header
+            self.start()
+            self.header = b""
+
+        self.forward(data)
+
+        return length
+
+    def close(self):
+        """
+        Wait for the archive to be fully unpacked, returns exit code
+        """
+        # archive smaller than any signature
+        if self.started is None:
+            self.start()
+            self.forward(self.header)
+
+        if self.sink is not None:
+            try:
+                self.sink.close()
+
+            except BrokenPipeError:
+                pass
+
+        status = 1 if self.error else 0
+
+        for process in self.processes:
+            status = process.wait() or status
+
+        self.stage.read = self.received
+        self.stage.extra = {'compression': self.compression or 'none', 'decoder': self.decoder}
+
+        return status
@@ -0,0 +1,60 @@
+import redis
+
+class HubBackend:
+    """
+    Batched keys lookup on a 0-db backend
+    """
+    def __init__(self, host, port, password=None, batch=1024, namespace="default"):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.batch = batch
+        self.namespace = namespace
+
+    def connect(self):
+        return redis.Redis(self.host, self.port, password=self.password or None, single_connection_client=True)
+
+    def exists(self, keys, conn=None):
+        """
+        Check existence of `keys` (bytes), one pipelined round-trip
+        per batch, returns the set of missing keys
+        """
+        if conn is None:
+            conn = self.connect()
+
+        keys = list(keys)
+        missing = set()
+
+        for i in range(0, len(keys), self.batch):
+            batch = keys[i:i + self.batch]
+
+            pipe = conn.pipeline(transaction=False)
+            for key in batch:
+                pipe.execute_command("EXISTS", key)
+
+            results = pipe.execute(raise_on_error=False)
+
+            for key, result in zip(batch, results):
+                if result != 1:
+                    missing.add(key)
+
+        return missing
+
+    def entries(self, conn=None):
+        """
+        Amount of keys stored on the namespace (0-db NSINFO), None
+        if not reported
+        """
+        if conn is None:
+            conn = self.connect()
+
+        info = conn.execute_command("NSINFO", self.namespace)
+        if isinstance(info, bytes):
+            info = info.decode()
+
+        for line in info.splitlines():
+            name, _, value = line.partition(":")
+            if name.strip() == "entries":
+                return int(value)
+
+        return None
@@ -0,0 +1,132 @@
+import os
+import json
+import threading
+import collections
+import hub.registry
+
+class HubContentCache:
+    """
+    Content-addressed cache of parsed flist information
+
+    A published flist never changes without its file changing, parsed
+    information (contents listing, metadata) are stored on disk keyed
+    by the flist md5 and the kind of information. Most recently used
+    entries are kept in memory as well.
+
+    Disk usage is bounded, least recently used entries are removed
+    when the cache grows over the limit
+    """
+    def __init__(self, config):
+        self.root = config['flist-cache-directory']
+        self.maxsize = config.get('flist-cache-size', 512 * 1024 * 1024)
+        self.maxmemory = config.get('flist-cache-memory', 64)
+
+        self.lock = threading.Lock()
+        self.memory = collections.OrderedDict()
+        self.files = collections.OrderedDict()
+        self.size = 0
+
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+        self.load()
+
+    def load(self):
+        entries = []
+
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+
+            stat = os.stat(os.path.join(self.root, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+
+        for mtime, name, size in sorted(entries):
+            self.files[name] = size
+            self.size += size
+
+    def filename(self, checksum, kind):
+        return "%s-%s.json" % (checksum, kind)
+
+    def get(self, checksum, kind):
+        if checksum is None:
+            return None
+
+        name = self.filename(checksum, kind)
+
+        with self.lock:
+            if name in self.memory:
+                self.memory.move_to_end(name)
+                self.files.move_to_end(name)
+                return self.memory[name]
+
+            if name not in self.files:
+                return None
+
+            self.files.move_to_end(name)
+
+        try:
+            path = os.path.join(self.root, name)
+            with open(path, "r") as f:
+                value = json.load(f)
+
+            # keep disk lru order across restart
+            os.utime(path)
+
+        except (FileNotFoundError, ValueError):
+            with self.lock:
+                self.size -= self.files.pop(name, 0)
+
+            return None
+
+        self.remember(name, value)
+        return value
+
+    def remember(self, name, value):
+        with self.lock:
+            self.memory[name] = value
+            self.memory.move_to_end(name)
+
+            while len(self.memory) > self.maxmemory:
+                self.memory.popitem(last=False)
+
+    def put(self, checksum, kind, value):
+        if checksum is None:
+            return False
+
+        name = self.filename(checksum, kind)
+        path = os.path.join(self.root, name)
+        temp = "%s.%d.tmp" % (path, threading.get_ident())
+
+        data = json.dumps(value).encode('utf-8')
+
+        with open(temp, "wb") as f:
+            f.write(data)
+
+        os.rename(temp, path)
+        self.remember(name, value)
+
+        with self.lock:
+            self.size -= self.files.pop(name, 0)
+            self.files[name] = len(data)
+            self.size += len(data)
+
+            expired = []
+            while self.size > self.maxsize and len(self.files) > 1:
+                oldest, size = self.files.popitem(last=False)
+                self.memory.pop(oldest, None)
+                self.size -= size
+                expired.append(oldest)
+
+        for oldest in expired:
+            try:
+                os.unlink(os.path.join(self.root, oldest))
+
+            except FileNotFoundError:
+                pass
+
+        return True
+
+def shared(config):
+    root = config['flist-cache-directory']
+    return hub.registry.instance(HubContentCache, root, lambda: HubContentCache(config))
@@ -0,0 +1,341 @@
+import os
+import json
+import time
+import base64
+import bisect
+import threading
+import hub.registry
+from stat import *
+
+try:
+    from inotify_simple import INotify, flags as inflags
+
+except ImportError:
+    INotify = None
+
+class HubCatalog:
+    """
+    In-memory catalog of repositories and flists
+
+    The whole public directory is walked once on startup, then each
+    repository is rescanned only when the hub writes into it, or when
+    the watcher notices an out-of-band change
+    """
+    def __init__(self, config):
+        self.config = config
+        self.root = config['public-directory']
+        self.lock = threading.Lock()
+        self.repos = {}
+        self.mtimes = {}
+        self.generation = 0
+        self.indexes = {}
+        self.watcher = None
+
+        self.load()
+
+    def clean_symlink(self, linkname):
+        return linkname.replace("../", "")
+
+    def scan(self, username):
+        """
+        Read contents of a repository directory from disk
+        """
+        userpath = os.path.join(self.root, username)
+        contents = []
+
+        for file in sorted(os.listdir(userpath)):
+            filepath = os.path.join(userpath, file)
+
+            try:
+                stat = os.lstat(filepath)
+
+            except FileNotFoundError:
+                continue
+
+            if S_ISLNK(stat.st_mode):
+                target = os.readlink(filepath)
+
+                contents.append({
+                    'name': file,
+                    'size': "--",
+                    'updated': int(stat.st_mtime),
+                    'type': 'symlink',
+                    'target': self.clean_symlink(target),
+                })
+
+            else:
+                contents.append({
+                    'name': file,
+                    'size': "%.2f KB" % ((stat.st_size) / 1024),
+                    'updated': int(stat.st_mtime),
+                    'type': 'regular',
+                })
+
+        return contents
+
+    def load(self):
+        print("[+] catalog: loading %s" % self.root)
+
+        try:
+            root = os.listdir(self.root)
+
+        except FileNotFoundError as e:
+            print(e)
+            root = []
+
+        for user in root:
+            self.refresh(user)
+
+        print("[+] catalog: %d repositories loaded" % len(self.repos))
+
+    def refresh(self, username):
+        """
+        Rescan one repository, drop it if it's not a directory anymore
+        """
+        userpath = os.path.join(self.root, username)
+
+        try:
+            mtime = os.stat(userpath).st_mtime_ns
+            contents = self.scan(username) if os.path.isdir(userpath) else None
+
+        except (FileNotFoundError, NotADirectoryError):
+            contents = None
+
+        with self.lock:
+            if contents is None:
+                self.mtimes.pop(username, None)
+                if self.repos.pop(username, None) is None:
+                    return
+
+            else:
+                self.mtimes[username] = mtime
+                if self.repos.get(username) == contents:
+                    return
+
+                self.repos[username] = contents
+
+            # notify listing consumers something changed
+            self.generation += 1
+
+    def repositories(self):
+        output = []
+
+        with self.lock:
+            users = sorted(self.repos.keys())
+
+        for user in users:
+            official = (user in self.config['official-repositories'])
+            output.append({'name': user, 'official': official})
+
+        return output
+
+    def contents(self, username):
+        with self.lock:
+            return self.repos.get(username)
+
+    def flists(self):
+        output = []
+
+        with self.lock:
+            for user in sorted(self.repos.keys()):
+                for entry in self.repos[user]:
+                    output.append("%s/%s" % (user, entry['name']))
+
+        return output
+
+    def fileslist(self):
+        with self.lock:
+            return {user: self.repos[user] for user in sorted(self.repos.keys())}
+
+    #
+    # sorted index and pagination
+    #
+    def index(self, sort):
+        """
+        All flists as (repository, entry) sorted by `sort` with their
+        sort keys, built once per generation
+        """
+        with self.lock:
+            found = self.indexes.get(sort)
+            if found and found[0] == self.generation:
+                return found[1], found[2]
+
+            generation = self.generation
+            items = [(user, entry) for user in self.repos for entry in self.repos[user]]
+
+        sortkey = sortkeys[sort]
+        items.sort(key=sortkey)
+        keys = [sortkey(item) for item in items]
+
+        with self.lock:
+            self.indexes[sort] = (generation, items, keys)
+
+        return items, keys
+
+    def search(self, sort="name", order="asc", cursor=None, limit=100, prefix=None, match=None, repository=None):
+        """
+        One page of flists matching filters, returns a list of
+        (repository, entry) and the cursor of the next page (None
+        when there is nothing more)
+        """
+        items, keys = self.index(sort)
+
+        if match:
+            match = match.lower()
+
+        try:
+            if order == "desc":
+                start = len(keys) if cursor is None else bisect.bisect_left(keys, cursor)
+                candidates = (items[i] for i in range(start - 1, -1, -1))
+
+            else:
+                start = 0 if cursor is None else bisect.bisect_right(keys, cursor)
+                candidates = (items[i] for i in range(start, len(items)))
+
+        except TypeError:
+            # cursor built for another sort
+            raise ValueError("invalid cursor")
+
+        page = []
+
+        for user, entry in candidates:
+            if repository and user != repository:
+                continue
+
+            if prefix and not entry['name'].startswith(prefix):
+                continue
+
+            if match and match not in ("%s/%s" % (user, entry['name'])).lower():
+                continue
+
+            if len(page) == limit:
+                return page, encode_cursor(sortkeys[sort](page[-1]))
+
+            page.append((user, entry))
+
+        return page, None
+
+    #
+    # out-of-band changes watcher
+    #
+    def watch(self):
+        if self.watcher is not None:
+            return False
+
+        target = self.watch_inotify if INotify is not None else self.watch_poll
+
+        self.watcher = threading.Thread(target=target, daemon=True)
+        self.watcher.start()
+
+        return True
+
+    def watch_inotify(self):
+        print("[+] catalog: watching changes with inotify")
+
+        inotify = INotify()
+        rootmask = inflags.CREATE | inflags.DELETE | inflags.MOVED_FROM | inflags.MOVED_TO | inflags.DELETE_SELF
+        usermask = rootmask | inflags.CLOSE_WRITE | inflags.ATTRIB
+
+        rootwd = inotify.add_watch(self.root, rootmask)
+        watches = {}
+
+        def follow(user):
+            userpath = os.path.join(self.root, user)
+            if os.path.isdir(userpath) and user not in watches.values():
+                try:
+                    watches[inotify.add_watch(userpath, usermask)] = user
+
+                except FileNotFoundError:
+                    pass
+
+        for user in list(self.repos.keys()):
+            follow(user)
+
+        while True:
+            changed = set()
+
+            for event in inotify.read(read_delay=100):
+                if event.wd == rootwd:
+                    if event.name:
+                        follow(event.name)
+                        changed.add(event.name)
+
+                    continue
+
+                if event.wd not in watches:
+                    continue
+
+                changed.add(watches[event.wd])
+
+                # repository directory removed, kernel drops the watch
+                if event.mask & (inflags.DELETE_SELF | inflags.IGNORED):
+                    del watches[event.wd]
+
+            for user in changed:
+                self.refresh(user)
+
+    def watch_poll(self):
+        """
+        Fallback when inotify is not available, only directories
+        modification time are checked, this covers added, removed
+        and renamed flists
+        """
+        interval = self.config.get('catalog-poll-interval', 10)
+        print("[+] catalog: polling changes every %d seconds" % interval)
+
+        while True:
+            time.sleep(interval)
+
+            try:
+                root = set(os.listdir(self.root))
+
+            except FileNotFoundError:
+                root = set()
+
+            root = set(user for user in root if os.path.isdir(os.path.join(self.root, user)))
+
+            with self.lock:
+                known = dict(self.mtimes)
+
+            for user in root | set(known.keys()):
+                try:
+                    mtime = os.stat(os.path.join(self.root, user)).st_mtime_ns
+
+                except FileNotFoundError:
+                    mtime = None
+
+                if mtime != known.get(user):
+                    self.refresh(user)
+
+#
+# regular files size are stored in KB (as string)
+#
+def entry_size(entry):
+    if entry['type'] != 'regular':
+        return 0
+
+    return float(entry['size'].split()[0])
+
+sortkeys = {
+    'name': lambda item: (item[0], item[1]['name']),
+    'mtime': lambda item: (item[1]['updated'], item[0], item[1]['name']),
+    'size': lambda item: (entry_size(item[1]), item[0], item[1]['name']),
+}
+
+#
+# cursors are opaque for clients, they contains sort key of the
+# last entry of the page
+#
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('utf-8')
+
+def decode_cursor(cursor):
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8'))))
+
+    except (ValueError, TypeError):
+        return None
+
+def shared(config):
+    root = config['public-directory']
+    return hub.registry.instance(HubCatalog, root, lambda: HubCatalog(config))
@@ -0,0 +1,120 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import hub.metrics
+import hub.offload
+import hub.registry
+from stat import *
+
+class HubChecksumIndex:
+    """
+    Persistent md5 index of published flists
+
+    Entries are keyed by the real path of the file and are only
+    trusted if inode, size and mtime still match the file on disk,
+    any change on the file invalidates the entry automatically
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS checksums (
+                path TEXT PRIMARY KEY,
+                inode INTEGER,
+                size INTEGER,
+                mtime INTEGER,
+                md5 TEXT
+            )
+        """)
+        self.db.commit()
+
+    def signature(self, stat):
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def compute(self, target):
+        hash_md5 = hashlib.md5()
+
+        with open(target, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hash_md5.update(chunk)
+
+        return hash_md5.hexdigest()
+
+    def lookup(self, path, signature):
+        with self.lock:
+            cursor = self.db.execute("SELECT inode, size, mtime, md5 FROM checksums WHERE path = ?", (path, ))
+            row = cursor.fetchone()
+
+        if row is None or tuple(row[0:3]) != signature:
+            return None
+
+        return row[3]
+
+    def get(self, target):
+        """
+        Returns md5 of `target`, hashing the file only if the index
+        does not contains an up-to-date entry for it
+        """
+        path = os.path.realpath(target)
+
+        try:
+            stat = os.stat(path)
+
+        except FileNotFoundError:
+            self.invalidate(path)
+            return None
+
+        if not S_ISREG(stat.st_mode):
+            return None
+
+        found = self.lookup(path, self.signature(stat))
+        hub.metrics.checksum(found is not None)
+
+        if found:
+            return found
+
+        return self.update(path)
+
+    def update(self, target):
+        """
+        (Re)compute md5 of `target` and store it on the index
+        """
+        path = os.path.realpath(target)
+
+        if not os.path.isfile(path):
+            return None
+
+        print("[+] md5: %s" % path)
+
+        before = os.stat(path)
+        checksum = hub.offload.run(self.compute, path)
+        after = os.stat(path)
+
+        # file changed while hashing, don't keep a wrong entry
+        if self.signature(before) != self.signature(after):
+            return checksum
+
+        inode, size, mtime = self.signature(after)
+
+        with self.lock:
+            self.db.execute(
+                "REPLACE INTO checksums (path, inode, size, mtime, md5) VALUES (?, ?, ?, ?, ?)",
+                (path, inode, size, mtime, checksum)
+            )
+            self.db.commit()
+
+        return checksum
+
+    def invalidate(self, target):
+        path = os.path.realpath(target)
+
+        with self.lock:
+            self.db.execute("DELETE FROM checksums WHERE path = ?", (path, ))
+            self.db.commit()
+
+def shared(config):
+    filename = config['checksum-index']
+    return hub.registry.instance(HubChecksumIndex, filename, lambda: HubChecksumIndex(filename))
@@ -2,54 +2,104 @@ import os
 import docker
 import uuid
 import tempfile
+import tarfile
+import shutil
+import json
+import time
+import threading
 import subprocess
 import uuid
 import traceback
 import pprint
 import pytoml as toml
-from hub.flist import HubPublicFlist
+import hub.reaper
+import hub.timing
+import hub.metrics
+import hub.offload
+import hub.registry
+from hub.flist import HubPublicFlist, HubFlist
+from hub.layers import HubLayerCache, HubImageArchive, export
 
 
 class HubDocker:
-    def __init__(self, config, announcer):
-        self.dockerclient = docker.from_env(timeout=240)
-        self.lowlevel = docker.APIClient(timeout=240)
+    def __init__(self, config, announcer, daemon=True):
+        self.dockerclient = None
+        self.lowlevel = None
+
+        # converting from image layout doesn't need any docker daemon
+        if daemon:
+            self.dockerclient = docker.from_env(timeout=240)
+            self.lowlevel = docker.APIClient(timeout=240)
+
         self.config = config
+        self.index = shared(config)
         self.jobid = str(uuid.uuid4())
         self.announcer = announcer
+        self.timing = hub.timing.HubTiming()
+
+        # pull progression is only computed a few times per second
+        rate = config.get('notifier-rate', 4)
+        self.interval = (1 / rate) if rate else 0
+        self.progressed = 0
 
         self.announcer.initialize(self.jobid)
         self.progress("Initializing docker converter", 0)
 
-    def container_boot(self, cn):
+    def container_boot(self, config):
         command = []
         args = []
         env = {}
         cwd = '/'
 
-        if cn.attrs['Config']['Entrypoint']:
-            command = cn.attrs['Config']['Entrypoint'][0]
+        if config.get('Entrypoint'):
+            command = config['Entrypoint'][0]
 
-            if len(cn.attrs['Config']['Entrypoint']) > 1:
-                args = cn.attrs['Config']['Entrypoint'][1:]
+            if len(config['Entrypoint']) > 1:
+                args = config['Entrypoint'][1:]
 
             else:
-                args = cn.attrs['Config']['Cmd']
+                args = config['Cmd'] or []
+
+        elif config.get('Cmd'):
+            command = config['Cmd'][0]
+            args = config['Cmd'][1:]
 
         else:
-            command = cn.attrs['Config']['Cmd'][0]
-            args = cn.attrs['Config']['Cmd'][1:]
+            command = "/bin/sh"
 
-        if cn.attrs['Config']['Env']:
-            for entry in cn.attrs['Config']['Env']:
+        if config.get('Env'):
+            for entry in config['Env']:
                 k, e, v = entry.partition("=")
                 env[k] = v
 
-        if cn.attrs['Config']['WorkingDir']:
-            cwd = cn.attrs['Config']['WorkingDir']
+        if config.get('WorkingDir'):
+            cwd = config['WorkingDir']
 
         return command, args, env, cwd
 
+    def startup(self, config, rootdir):
+        """
+        Write docker init command as container startup file
+        """
+        command, args, env, cwd = self.container_boot(config)
+
+        boot = {
+            'startup': {
+                'entry': {
+                    'name': "core.system",
+                    'args': {
+                        'name': command,
+                        'args': args,
+                        'env': env,
+                        'dir': cwd,
+                    }
+                }
+            }
+        }
+
+        with open(os.path.join(rootdir, '.startup.toml'), 'w') as f:
+            f.write(toml.dumps(boot))
+
     def notify(self, message):
         self.announcer.push(self.jobid, message)
 
@@ -59,8 +109,14 @@ class HubDocker:
 
 
     def convert(self, dockerimage, username="dockers"):
+        return self.run(self.converter, dockerimage, username)
+
+    def convert_archive(self, path, flistname, username="dockers"):
+        return self.run(self.converter_archive, path, flistname, username)
+
+    def run(self, converter, *args):
         try:
-            response = self.converter(dockerimage, username)
+            response = converter(*args)
 
         except Exception as e:
             print(traceback.format_exc())
@@ -83,6 +139,22 @@ class HubDocker:
         if ":" not in dockerimage:
             dockerimage = "%s:latest" % dockerimage
 
+        flistname = dockerimage.replace(":", "-").replace('/', '-')
+
+        flist = HubPublicFlist(self.config, username, flistname, self.announcer)
+        flist.raw.jobid = self.jobid
+        flist.raw.timing = self.timing
+
+        #
+        # same image (digest) already converted, nothing to rebuild
+        #
+        digest = self.digest(dockerimage)
+
+        if digest:
+            existing = self.converted(digest, flist)
+            if existing:
+                return existing
+
         #
         # loading image from docker-hub
         #
@@ -90,11 +162,13 @@ class HubDocker:
         self.progress("Pulling docker image: %s" % dockerimage, 10)
 
         try:
-            # progress pull
-            self.pull(dockerimage)
+            with self.timing.stage('pull') as stage:
+                # progress pull
+                stage.read, stage.files = self.pull(dockerimage)
+                hub.metrics.pulled(stage.read)
 
-            # fetch real image name
-            image = self.dockerclient.images.pull(dockerimage)
+                # fetch real image name
+                image = self.dockerclient.images.pull(dockerimage)
 
         except docker.errors.ImageNotFound:
             return {'status': 'error', 'message': 'docker image not found'}
@@ -102,6 +176,161 @@ class HubDocker:
         except docker.errors.APIError:
             return {'status': 'error', 'message': 'could not pull this image'}
 
+        flist.user_create()
+
+        #
+        # bundle the image, from layers cache when possible
+        #
+        info = None
+
+        if self.config['docker-layers-cache']:
+            info = self.converter_layers(image, dockername, flist)
+
+        if info is None:
+            info = self.converter_export(image, dockerimage, dockername, flist)
+
+        flist.updated()
+
+        # with the layers cache, the image is kept: pulling a newer
+        # version of it only fetches (and converts) its new layers
+        if not self.config['docker-layers-cache']:
+            print("[+] docker-convert: cleaning up the docker image")
+            self.progress("Cleaning up docker image", 99)
+
+            with self.timing.stage('cleanup'):
+                self.dockerclient.images.remove(dockerimage, force=True)
+
+        if info['success'] == False:
+            return {'status': 'error', 'message': info['error']['message']}
+
+        if digest:
+            self.index.record(digest, flist, info['response'])
+
+        self.progress("Image ready !", 100)
+
+        return {'status': 'success', 'file': flist.filename, 'flist': info['response'], 'timing': self.timing.dump()}
+
+    def digest(self, dockerimage):
+        """
+        Image digest from the registry, without pulling the image
+        """
+        try:
+            return self.dockerclient.images.get_registry_data(dockerimage).id
+
+        except docker.errors.APIError as e:
+            print("[-] docker-convert: could not fetch image digest: %s" % e)
+            return None
+
+    def converted(self, digest, flist):
+        """
+        Reuse flist of an image with the same digest, if this flist
+        still exists unchanged, it's copied to the requested target
+        """
+        entry = self.index.get(digest)
+        if entry is None:
+            return None
+
+        source = HubPublicFlist(self.config, entry['username'], entry['filename'])
+        if not source.file_exists or source.checksum != entry['checksum']:
+            return None
+
+        print("[+] docker-convert: %s already converted: %s/%s" % (digest, source.username, source.filename))
+
+        if source.target != flist.target:
+            flist.user_create()
+
+            if os.path.lexists(flist.target):
+                os.unlink(flist.target)
+
+            shutil.copyfile(source.target, flist.target)
+            flist.updated()
+
+        return {'status': 'success', 'file': flist.filename, 'flist': entry['flist'], 'timing': self.timing.dump()}
+
+    def converter_layers(self, image, dockername, flist):
+        """
+        Build the flist by merging each image layer converted to a flist,
+        layers already converted by a previous conversion are reused.
+        Returns None if the image can't be converted that way
+        """
+        layers = HubLayerCache(self.config, self.announcer, self.jobid, self.timing)
+        diffids = image.attrs['RootFS']['Layers']
+
+        # a previous conversion already found some files deleted
+        for diffid in diffids:
+            found = layers.get(diffid)
+            if found and found['whiteouts']:
+                print("[+] docker-convert: layer %s deletes files, cannot merge layers" % diffid)
+                return None
+
+        tmpdir = hub.reaper.track(tempfile.TemporaryDirectory(prefix=dockername, dir=self.config['docker-work-directory']))
+        archive = None
+
+        try:
+            missing = [diffid for diffid in diffids if layers.get(diffid) is None]
+
+            if len(missing) > 0:
+                print("[+] docker-convert: exporting image, %d new layers" % len(missing))
+                self.progress("Exporting image layers", 52)
+
+                # layers already converted are skipped while streaming
+                layoutdir = os.path.join(tmpdir.name, "image")
+                os.mkdir(layoutdir)
+
+                with self.timing.stage('export') as stage:
+                    stage.files, stage.written = export(image.save(named=False), layoutdir, diffids, missing)
+
+                archive = HubImageArchive(layoutdir)
+
+            for index, diffid in enumerate(diffids):
+                if layers.get(diffid) is not None:
+                    continue
+
+                self.progress("Converting layer %d / %d" % (index + 1, len(diffids)), 56)
+                info = layers.build(diffid, archive.layer(archive.diffids.index(diffid)))
+
+                if info is None:
+                    return None
+
+                if info['whiteouts']:
+                    print("[+] docker-convert: layer %s deletes files, cannot merge layers" % diffid)
+                    return None
+
+            #
+            # docker init command to container startup command
+            #
+            print("[+] docker-convert: creating container entrypoint")
+            self.progress("Creating container metadata", 90)
+
+            rootdir = os.path.join(tmpdir.name, "startup")
+            os.mkdir(rootdir)
+            self.startup(image.attrs['Config'], rootdir)
+
+            startup = HubFlist(self.config)
+            startupflist = os.path.join(tmpdir.name, "startup.flist")
+            startup.create(rootdir, startupflist)
+
+            print("[+] docker-convert: merging %d layers" % len(diffids))
+            self.progress("Merging layers", 92)
+
+            sources = [layers.target(diffid) for diffid in diffids] + [startupflist]
+            if not flist.raw.mergefiles(flist.target, sources):
+                return None
+
+        finally:
+            if archive:
+                archive.close()
+
+            with self.timing.stage('cleanup'):
+                tmpdir.cleanup()
+
+        stats = {'layers': len(diffids), 'converted': len(missing)}
+        return {'success': True, 'response': stats}
+
+    def converter_export(self, image, dockerimage, dockername, flist):
+        """
+        Build the flist from the full root filesystem of a temporary container
+        """
         #
         # building init-command line
         #
@@ -124,13 +353,15 @@ class HubDocker:
         # exporting docker
         #
         print("[+] docker-convert: creating target directory")
-        tmpdir = tempfile.TemporaryDirectory(prefix=dockername, dir=self.config['docker-work-directory'])
+        tmpdir = hub.reaper.track(tempfile.TemporaryDirectory(prefix=dockername, dir=self.config['docker-work-directory']))
         os.chmod(tmpdir.name, 0o755)
 
         print("[+] docker-convert: dumping files to: %s" % tmpdir.name)
         self.progress("Extracting container root filesystem", 54)
 
-        subprocess.call(['sh', '-c', 'docker export %s | tar -xpf - -C %s' % (dockername, tmpdir.name)])
+        with self.timing.stage('export') as stage:
+            subprocess.call(['sh', '-c', 'docker export %s | tar -xpf - -C %s' % (dockername, tmpdir.name)])
+            stage.files, stage.written = flist.raw.usage(tmpdir.name)
 
         #
         # docker init command to container startup command
@@ -138,24 +369,7 @@ class HubDocker:
         print("[+] docker-convert: creating container entrypoint")
         self.progress("Creating container metadata", 55)
 
-        command, args, env, cwd = self.container_boot(cn)
-
-        boot = {
-            'startup': {
-                'entry': {
-                    'name': "core.system",
-                    'args': {
-                        'name': command,
-                        'args': args,
-                        'env': env,
-                        'dir': cwd,
-                    }
-                }
-            }
-        }
-
-        with open(os.path.join(tmpdir.name, '.startup.toml'), 'w') as f:
-            f.write(toml.dumps(boot))
+        self.startup(cn.attrs['Config'], tmpdir.name)
 
         #
         # bundle the image
@@ -163,32 +377,84 @@ class HubDocker:
         print("[+] docker-convert: parsing the flist")
         self.progress("Preparing filesystem flist", 56)
 
-        flistname = dockerimage.replace(":", "-").replace('/', '-')
+        info = flist.raw.create(tmpdir.name, flist.target)
+
+        print("[+] docker-convert: cleaning temporary files")
+        self.progress("Cleaning up temporary files", 95)
+
+        with self.timing.stage('cleanup') as stage:
+            stage.files = flist.raw.usage(tmpdir.name)[0]
+            tmpdir.cleanup()
+
+            print("[+] docker-convert: destroying the container")
+            self.progress("Cleaning up container", 97)
+            cn.remove(force=True)
+
+        return info
+
+
+    def converter_archive(self, path, flistname, username="dockers"):
+        """
+        Build the flist from an image layout (docker save or OCI layout,
+        directory or tarball), layers are applied one after the other
+        without any docker daemon
+        """
+        print("[+] docker-convert: loading image layout: %s" % path)
+        self.progress("Loading image layout", 10)
+
+        try:
+            archive = HubImageArchive(path)
+
+        except (KeyError, IndexError, ValueError, FileNotFoundError, tarfile.TarError):
+            return {'status': 'error', 'message': 'could not read image layout'}
+
+        flistname = flistname.replace(":", "-").replace('/', '-')
 
         flist = HubPublicFlist(self.config, username, flistname, self.announcer)
         flist.raw.jobid = self.jobid
+        flist.raw.timing = self.timing
         flist.user_create()
-        info = flist.raw.create(tmpdir.name, flist.target)
 
-        print("[+] docker-convert: cleaning temporary files")
-        self.progress("Cleaning up temporary files", 95)
-        tmpdir.cleanup()
+        tmpdir = hub.reaper.track(tempfile.TemporaryDirectory(prefix="layout-", dir=self.config['docker-work-directory']))
+        os.chmod(tmpdir.name, 0o755)
+
+        try:
+            with self.timing.stage('unpack') as stage:
+                for index in range(len(archive.layers)):
+                    print("[+] docker-convert: applying layer %s" % archive.layers[index])
+                    percent = int(10 + ((index / len(archive.layers)) * 45))
+                    self.progress("Applying layer %d / %d" % (index + 1, len(archive.layers)), percent)
+
+                    hub.offload.run(archive.apply, index, tmpdir.name)
+
+                stage.files, stage.written = flist.raw.usage(tmpdir.name)
+
+            print("[+] docker-convert: creating container entrypoint")
+            self.progress("Creating container metadata", 55)
+
+            self.startup(archive.config.get('config') or {}, tmpdir.name)
+
+            print("[+] docker-convert: parsing the flist")
+            self.progress("Preparing filesystem flist", 56)
+
+            info = flist.raw.create(tmpdir.name, flist.target)
+            flist.updated()
 
-        print("[+] docker-convert: destroying the container")
-        self.progress("Cleaning up container", 97)
-        cn.remove(force=True)
+        finally:
+            archive.close()
 
-        print("[+] docker-convert: cleaning up the docker image")
-        self.progress("Cleaning up docker image", 99)
-        self.dockerclient.images.remove(dockerimage, force=True)
+            print("[+] docker-convert: cleaning temporary files")
+            self.progress("Cleaning up temporary files", 95)
+
+            with self.timing.stage('cleanup'):
+                tmpdir.cleanup()
 
         if info['success'] == False:
             return {'status': 'error', 'message': info['error']['message']}
 
         self.progress("Image ready !", 100)
 
-        return {'status': 'success', 'file': flist.filename, 'flist': info['response'], 'timing': {}}
-
+        return {'status': 'success', 'file': flist.filename, 'flist': info['response'], 'timing': self.timing.dump()}
 
     #
     # docker pull handler
@@ -251,6 +517,15 @@ class HubDocker:
         # percentage bar goes from 10 to 50% (which is 40%)
         return int(10 + ((done / todo) * 40))
 
+    def progress_due(self):
+        now = time.monotonic()
+
+        if now - self.progressed < self.interval:
+            return False
+
+        self.progressed = now
+        return True
+
     def pull_downloaded(self, layers):
         for i in layers:
             if layers[i]['download']['done'] == False:
@@ -259,6 +534,10 @@ class HubDocker:
         return True
 
     def pull(self, image):
+        """
+        Pull `image` with progression, returns amount of bytes
+        downloaded and amount of layers pulled
+        """
         layers = {}
         downloaded = False
 
@@ -275,7 +554,9 @@ class HubDocker:
             if line['status'] == 'Downloading':
                 layers[line['id']]['download']['current'] = line['progressDetail']['current']
                 layers[line['id']]['download']['total'] = line['progressDetail']['total']
-                self.progress_download(layers)
+
+                if self.progress_due():
+                    self.progress_download(layers)
 
             # we can now notify extracting
             if line['status'] == 'Download complete':
@@ -288,7 +569,48 @@ class HubDocker:
                 layers[line['id']]['extract']['done'] = True
 
             if line['status'] == 'Extracting':
-                if self.pull_downloaded(layers):
+                if self.pull_downloaded(layers) and self.progress_due():
                     self.progress_extract(layers, line)
 
+        received = sum(max(layer['download']['current'], layer['download']['total']) for layer in layers.values())
+
+        return received, len(layers)
+
+
+class HubDockerIndex:
+    """
+    Docker images already converted, image digest to flist mapping
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = {}
+
+        if os.path.exists(filename):
+            with open(filename, "r") as f:
+                self.entries = json.load(f)
+
+    def get(self, digest):
+        with self.lock:
+            return self.entries.get(digest)
+
+    def record(self, digest, flist, stats):
+        entry = {
+            'username': flist.username,
+            'filename': flist.filename,
+            'checksum': flist.checksum,
+            'flist': stats,
+        }
+
+        with self.lock:
+            self.entries[digest] = entry
+
+            temp = self.filename + ".tmp"
+            with open(temp, "w") as f:
+                f.write(json.dumps(self.entries))
+
+            os.rename(temp, self.filename)
 
+def shared(config):
+    filename = config['docker-index']
+    return hub.registry.instance(HubDockerIndex, filename, lambda: HubDockerIndex(filename))
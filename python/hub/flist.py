@@ -7,6 +7,17 @@ import redis
 import json
 import uuid
 import shutil
+import time
+import hub.checksum
+import hub.catalog
+import hub.session
+import hub.cache
+import hub.reaper
+import hub.archive
+import hub.timing
+import hub.metrics
+from hub.backend import HubBackend
+from concurrent.futures import ThreadPoolExecutor
 
 class HubFlist:
     def __init__(self, config, announcer=None):
@@ -16,6 +27,7 @@ class HubFlist:
             config['zflist-bin'] = "/opt/0-flist/zflist/zflist"
 
         self.zflist = config['zflist-bin']
+        self.checksums = hub.checksum.shared(config)
 
         self.backstr = json.dumps({
             'host': config['backend-internal-host'],
@@ -30,6 +42,8 @@ class HubFlist:
         self.opened = False
         self.jobid = str(uuid.uuid4())
         self.announcer = announcer
+        self.timing = hub.timing.HubTiming()
+        self.scanned = {}
 
         self.environ = dict(
             os.environ,
@@ -52,28 +66,70 @@ class HubFlist:
         """
         Unpack tar archive `filepath` into `target` directory
         """
+        print("[+] upacking: %s" % filepath)
+
+        with open(filepath, "rb") as f:
+            return self.unpack_stream(f, os.path.basename(filepath), target)
+
+    def unpacker(self, filename, target=None):
+        """
+        Start unpacking into `target` directory an archive written by
+        chunks on the returned object, use `unpacked` when everything
+        was written
+        """
         if target is None:
             target = self.tmpdir.name
 
         self.ensure(target)
 
-        print("[+] upacking: %s" % filepath)
-        args = ["tar", "-xpf", filepath, "-C", target]
-        p = subprocess.Popen(args)
-        p.wait()
+        print("[+] upacking stream: %s" % filename)
+        return hub.archive.HubArchiveUnpacker(target)
+
+    def unpacked(self, unpacker):
+        status = unpacker.close()
+
+        stage = unpacker.stage
+        stage.files, stage.written = self.usage(unpacker.target)
+        self.timing.end(stage)
+
+        print("[+] unpacked: %s archive, %s, %.2f seconds" % (stage.extra['compression'], unpacker.decoder, stage.wall))
+
+        return status
+
+    def usage(self, rootdir):
+        """
+        Amount of files and bytes of `rootdir`, computed once per build
+        """
+        if rootdir not in self.scanned:
+            self.scanned[rootdir] = hub.timing.usage(rootdir)
+
+        return self.scanned[rootdir]
 
-        return 0
+    def unpack_stream(self, stream, filename, target=None):
+        """
+        Unpack tar archive read from `stream` (file object) into `target`
+        directory, the archive itself is never written on disk
+        """
+        unpacker = self.unpacker(filename, target)
+
+        for chunk in iter(lambda: stream.read(1 << 20), b""):
+            unpacker.write(chunk)
+
+        return self.unpacked(unpacker)
 
     def execute(self, command, args=[], raw=False):
+        name = command
         command = [self.zflist, command] + args
         print(command)
 
         # set json output depending on raw output or not
-        # this is useful for cat command
-        self.environ['ZFLIST_JSON'] = "1" if raw == False else "0"
+        # this is useful for cat command, environment is copied
+        # since an opened session can be used by multiple threads
+        environ = dict(self.environ, ZFLIST_JSON="1" if raw == False else "0")
 
         value = b''
-        p = subprocess.Popen(command, env=self.environ, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        started = time.monotonic()
+        p = subprocess.Popen(command, env=environ, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         # (output, err) = p.communicate()
 
         # progressing tracking
@@ -102,6 +158,8 @@ class HubFlist:
                     self.progress("Building: %s" % message, percent)
                     percentage = percent
 
+        hub.metrics.zflist(name, time.monotonic() - started)
+
         # print(code, output, err)
         output = value
         print("Code: %d, %s" % (code, output))
@@ -117,8 +175,18 @@ class HubFlist:
 
         return payload
 
+    def batch(self, commands):
+        """
+        Execute independent read-only commands (list of (command, args))
+        on the opened flist concurrently, payloads are returned in order
+        """
+        with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+            jobs = [executor.submit(self.execute, command, args) for command, args in commands]
+
+        return [job.result() for job in jobs]
+
     def workspace(self, prefix="workspace-"):
-        return tempfile.TemporaryDirectory(prefix=prefix, dir=self.config['flist-work-directory'])
+        return hub.reaper.track(tempfile.TemporaryDirectory(prefix=prefix, dir=self.config['flist-work-directory']))
 
     def loads(self, source):
         self.source = source
@@ -127,7 +195,10 @@ class HubFlist:
         if self.opened:
             return False
 
-        self.execute("open", [self.source])
+        payload = self.execute("open", [self.source])
+        if payload['status'] != 0:
+            return False
+
         self.opened = True
 
         return True
@@ -142,9 +213,11 @@ class HubFlist:
         return True
 
     def contents(self):
-        self.open()
+        opened = self.open()
         ls = self.execute("find")
-        self.close()
+
+        if opened:
+            self.close()
 
         return ls
 
@@ -161,49 +234,158 @@ class HubFlist:
 
         return check
 
+    def chunks(self):
+        """
+        Backend keys (hex) of all files chunks of the flist
+        """
+        opened = self.open()
+        payload = self.execute("chunks")
+
+        if opened:
+            self.close()
+
+        return self.chunkkeys(payload)
+
+    def chunkkeys(self, payload):
+        if not payload.get("success"):
+            return None
+
+        keys = []
+        for chunk in payload["response"]:
+            # chunks can be reported as plain key or with details
+            keys.append(chunk if isinstance(chunk, str) else chunk["id"])
+
+        return keys
+
     def readme(self, rootdir):
+        """
+        Import optional readme, returns amount of bytes imported
+        """
         files = [".README.md", ".README"]
+        size = 0
 
         for f in files:
             fp = os.path.join(rootdir, f)
 
             if os.path.exists(fp):
                 self.setreadme(fp)
+                size += os.path.getsize(fp)
+
+        return size
+
+    def backend(self):
+        return HubBackend(
+            self.config['backend-internal-host'],
+            self.config['backend-internal-port'],
+            self.config['backend-internal-pass'],
+        )
+
+    def dedup(self, backend, before):
+        """
+        Deduplication statistics of the opened flist, `before` is the
+        amount of backend keys before the build
+        """
+        with self.timing.stage('dedup') as stage:
+            keys = self.chunkkeys(self.execute("chunks"))
+            if keys is None:
+                return None
+
+            keys = set(keys)
+            stage.files = len(keys)
+
+            try:
+                conn = backend.connect()
+                after = backend.entries(conn)
+                missing = backend.exists([bytes.fromhex(key) for key in keys], conn)
+
+            except redis.RedisError as e:
+                print("[-] dedup: could not query backend: %s" % e)
+                return None
+
+            if before is None or after is None:
+                return None
+
+            # concurrent builds add keys as well, it's an upper bound
+            added = min(max(after - before, 0), len(keys))
+
+            stats = {
+                'chunks': len(keys),
+                'new': added,
+                'existing': len(keys) - added,
+                'missing': len(missing),
+                'ratio': ((len(keys) - added) / len(keys)) if keys else 0,
+            }
+
+            stage.extra = {'dedup-ratio': round(stats['ratio'], 3)}
+
+        print("[+] dedup: %d/%d chunks already stored (%.1f %%)" % (stats['existing'], stats['chunks'], stats['ratio'] * 100))
+        return stats
 
     def create(self, rootdir, target):
-        self.execute("init")
-        putdir = self.execute("putdir", [rootdir, "/"])
+        backend = None
+        before = None
+        dedup = None
+
+        # optional deduplication statistics, backend keys are
+        # counted before and after the build
+        if self.config.get('dedup-stats'):
+            backend = self.backend()
+
+            try:
+                before = backend.entries()
+
+            except redis.RedisError as e:
+                print("[-] dedup: could not query backend: %s" % e)
+                backend = None
+
+        with self.timing.stage('putdir') as stage:
+            stage.files, stage.read = self.usage(rootdir)
+
+            self.execute("init")
+            putdir = self.execute("putdir", [rootdir, "/"])
 
         # include optional readme
-        self.readme(rootdir)
+        with self.timing.stage('readme') as stage:
+            stage.read = self.readme(rootdir)
+            stage.files = 1 if stage.read else 0
 
-        self.execute("commit", [target])
-        self.execute("close")
+        with self.timing.stage('commit') as stage:
+            self.execute("commit", [target])
 
-        return putdir
+            if os.path.isfile(target):
+                stage.files = 1
+                stage.written = os.path.getsize(target)
 
-    def checksum(self, target):
-        """
-        Compute md5 hash of the flist
-        """
-        print("[+] md5: %s" % target)
+        if backend is not None and putdir['success']:
+            dedup = self.dedup(backend, before)
 
-        hash_md5 = hashlib.md5()
+        with self.timing.stage('commit'):
+            self.execute("close")
 
-        if not os.path.isfile(target):
-            return None
+        if dedup is not None:
+            putdir['response']['dedup'] = dedup
 
-        with open(target, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
+        return putdir
 
-        return hash_md5.hexdigest()
+    def checksum(self, target):
+        """
+        Md5 hash of the flist, served from the checksum index
+        when the file didn't change since last computation
+        """
+        return self.checksums.get(target)
 
     def merge(self, target, sources):
         fixedsources = []
         for source in sources:
             fixedsources.append(os.path.join(self.config['public-directory'], source))
 
+        return self.mergefiles(target, fixedsources)
+
+    def mergefiles(self, target, fixedsources):
+        """
+        Merge flists `fixedsources` (full path) into `target`, the
+        first one is used as base, next ones are merged in order
+        """
         self.execute("open", [fixedsources[0]])
 
         for source in fixedsources[1:]:
@@ -223,26 +405,33 @@ class HubFlist:
         found = self.execute("stat", [filename])
         return found['success']
 
-    def metadata(self, metadata):
-        payload = self.execute("metadata", [metadata])
-
+    def metavalue(self, payload):
         if not payload["success"]:
             return None
 
         return payload["response"]["value"]
 
+    def metadata(self, metadata):
+        return self.metavalue(self.execute("metadata", [metadata]))
 
     def allmetadata(self):
+        """
+        All known metadata entries, None if the flist can't be opened
+        """
+        opened = self.open()
+
         if not self.opened:
-            self.open()
+            return None
 
-        data = {}
         entries = ["readme", "backend", "entrypoint", "environ", "port", "volume"]
+        payloads = self.batch([("metadata", [entry]) for entry in entries])
 
-        for entry in entries:
-            data[entry] = self.metadata(entry)
+        data = {}
+        for entry, payload in zip(entries, payloads):
+            data[entry] = self.metavalue(payload)
 
-        self.close()
+        if opened:
+            self.close()
 
         return data
 
@@ -299,36 +488,77 @@ class HubPublicFlist:
             self.filename += ".flist"
 
         self.raw = HubFlist(config, announcer)
+        self.catalog = hub.catalog.shared(config)
+        self.sessions = hub.session.shared(config, HubFlist)
+        self.cache = hub.cache.shared(config)
 
     def commit(self):
         if self.raw.source != self.target:
             self.user_create()
             shutil.copyfile(self.raw.source, self.target)
+            self.updated()
 
     def loads(self, source):
         return self.raw.loads(source)
 
     def contents(self):
-        return self.raw.contents()
+        checksum = self.raw.checksum(self.raw.source)
+
+        cached = self.cache.get(checksum, "contents")
+        if cached is not None:
+            return cached
+
+        with self.sessions.use(self.raw.source) as session:
+            contents = session.contents()
+
+        if contents['status'] == 0:
+            self.cache.put(checksum, "contents", contents)
+
+        return contents
 
     def validate(self):
         return self.raw.validate()
 
-    def create(self, source):
+    def create(self, workspace):
+        """
+        Build the flist from an already unpacked `workspace`
+        """
         self.user_create()
 
-        workspace = self.raw.workspace()
-        self.raw.unpack(source, workspace.name)
         stats = self.raw.create(workspace.name, self.target)
-        os.unlink(source)
+        self.updated()
+
+        with self.raw.timing.stage('cleanup') as stage:
+            stage.files = self.raw.usage(workspace.name)[0]
+            workspace.cleanup()
 
-        info = {"filename": self.filename, "flist": stats['response']}
+        info = {"filename": self.filename, "flist": stats['response'], "timing": self.raw.timing.dump()}
 
         self.raw.progress("Image ready !", 100)
         self.raw.notify({"status": "info", "info": info})
         self.announcer.finalize(self.raw.jobid)
 
-        return None
+        return info
+
+    def create_archive(self, filepath):
+        """
+        Build the flist from an archive already stored on disk
+        """
+        workspace = self.raw.workspace()
+
+        # never publish (nor replace an existing flist) from an
+        # empty or partially unpacked workspace
+        if self.raw.unpack(filepath, workspace.name) != 0:
+            workspace.cleanup()
+
+            message = "could not unpack archive"
+            self.raw.notify({"status": "error", "message": message})
+            self.announcer.finalize(self.raw.jobid)
+            self.announcer.terminate(self.raw.jobid)
+
+            return {"status": "error", "message": message}
+
+        return self.create(workspace)
 
     @property
     def target(self):
@@ -345,6 +575,7 @@ class HubPublicFlist:
     def user_create(self):
         if not self.user_exists:
             os.mkdir(self.user_path)
+            self.catalog.refresh(self.username)
 
     @property
     def file_exists(self):
@@ -356,7 +587,47 @@ class HubPublicFlist:
         return self.raw.checksum(self.target)
 
     def merge(self, sources):
-        return self.raw.merge(self.target, sources)
+        merged = self.raw.merge(self.target, sources)
+        if merged == True:
+            self.updated()
+
+        return merged
+
+    def updated(self):
+        """
+        Target file was (re)written, refresh indexes
+        """
+        # a symlink doesn't own the checksum of its target
+        if not os.path.islink(self.target):
+            self.raw.checksums.update(self.target)
+
+        self.catalog.refresh(self.username)
+
+    def remove(self):
+        if not os.path.islink(self.target):
+            self.raw.checksums.invalidate(self.target)
+
+        os.unlink(self.target)
+        self.catalog.refresh(self.username)
+
+    def rename(self, destination):
+        if not os.path.islink(self.target):
+            self.raw.checksums.invalidate(self.target)
+
+        os.rename(self.target, destination.target)
+        destination.updated()
 
     def allmetadata(self):
-        return self.raw.allmetadata()
+        checksum = self.raw.checksum(self.raw.source)
+
+        cached = self.cache.get(checksum, "metadata")
+        if cached is not None:
+            return cached
+
+        with self.sessions.use(self.raw.source) as session:
+            metadata = session.allmetadata()
+
+        if metadata is not None:
+            self.cache.put(checksum, "metadata", metadata)
+
+        return metadata
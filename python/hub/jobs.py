@@ -0,0 +1,157 @@
+import time
+import threading
+import traceback
+import collections
+import hub.metrics
+
+class HubJob:
+    def __init__(self, jobid, username, kind, target, args):
+        self.jobid = jobid
+        self.username = username
+        self.kind = kind
+        self.target = target
+        self.args = args
+
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def dump(self):
+        return {
+            'id': self.jobid,
+            'username': self.username,
+            'type': self.kind,
+            'status': self.status,
+            'created': int(self.created),
+            'started': int(self.started) if self.started else None,
+            'finished': int(self.finished) if self.finished else None,
+            'result': self.result,
+            'error': self.error,
+        }
+
+class HubJobs:
+    """
+    Bounded build jobs scheduler
+
+    Jobs (flist build, docker conversion) are queued and executed by
+    a fixed amount of workers, a user can't have more than 'jobs-per-user'
+    jobs running at the same time, other users jobs are picked meanwhile
+    """
+    def __init__(self, config):
+        self.queuesize = config.get('jobs-queue-size', 64)
+        self.workers = config.get('jobs-workers', 2)
+        self.peruser = config.get('jobs-per-user', 1)
+        self.keep = config.get('jobs-history', 1024)
+
+        self.condition = threading.Condition()
+        self.pending = collections.deque()
+        self.running = collections.Counter()
+        self.history = collections.deque()
+        self.jobs = {}
+        self.threads = []
+
+    def start(self):
+        print("[+] jobs: starting %d workers" % self.workers)
+
+        for i in range(self.workers):
+            worker = threading.Thread(target=self.worker, daemon=True)
+            worker.start()
+            self.threads.append(worker)
+
+    def submit(self, jobid, username, kind, target, args=()):
+        """
+        Queue a new job, returns None if the queue is full
+        """
+        with self.condition:
+            if len(self.pending) >= self.queuesize:
+                print("[-] jobs: queue full, rejecting job %s" % jobid)
+                return None
+
+            job = HubJob(jobid, username, kind, target, args)
+            self.jobs[jobid] = job
+            self.pending.append(job)
+            self.report()
+            self.condition.notify()
+
+        print("[+] jobs: %s queued (%s, %s)" % (jobid, kind, username))
+        return job
+
+    def get(self, jobid):
+        with self.condition:
+            return self.jobs.get(jobid)
+
+    def next(self):
+        # needs to be called with condition held
+        for job in self.pending:
+            if self.running[job.username] < self.peruser:
+                self.pending.remove(job)
+                return job
+
+        return None
+
+    def worker(self):
+        while True:
+            with self.condition:
+                job = self.next()
+                while job is None:
+                    self.condition.wait()
+                    job = self.next()
+
+                self.running[job.username] += 1
+                job.status = "running"
+                job.started = time.time()
+                self.report()
+
+            self.execute(job)
+
+            with self.condition:
+                self.running[job.username] -= 1
+                self.finished(job)
+                self.report()
+
+                # a job of this user could be waiting
+                self.condition.notify_all()
+
+            job.done.set()
+
+    def execute(self, job):
+        try:
+            job.result = job.target(*job.args)
+
+        except Exception as e:
+            print(traceback.format_exc())
+            job.error = str(e)
+
+        failed = job.error is not None
+        if isinstance(job.result, dict) and job.result.get('status') == 'error':
+            job.error = job.result.get('message')
+            failed = True
+
+        job.status = "failed" if failed else "done"
+        job.finished = time.time()
+
+    def finished(self, job):
+        # needs to be called with condition held
+        self.history.append(job.jobid)
+
+        while len(self.history) > self.keep:
+            self.jobs.pop(self.history.popleft(), None)
+
+    def report(self):
+        # needs to be called with condition held
+        hub.metrics.jobs(len(self.pending), sum(self.running.values()))
+
+    def stats(self):
+        with self.condition:
+            return {
+                'queued': len(self.pending),
+                'running': sum(self.running.values()),
+                'workers': self.workers,
+            }
@@ -0,0 +1,413 @@
+import os
+import json
+import hashlib
+import shutil
+import tarfile
+import threading
+from hub.flist import HubFlist
+
+class HubImageArchive:
+    """
+    Docker image layout, either saved with 'docker save' or an OCI image
+    layout (index.json and blobs), as a directory or a tarball
+    """
+    def __init__(self, path):
+        self.path = path
+        self.archive = None
+
+        if not os.path.isdir(path):
+            self.archive = tarfile.open(path, "r:*")
+
+        if self.exists("index.json") and not self.exists("manifest.json"):
+            self.load_oci()
+
+        else:
+            self.load_docker()
+
+        self.diffids = self.config['rootfs']['diff_ids']
+
+    def exists(self, name):
+        try:
+            self.open(name).close()
+            return True
+
+        except (KeyError, FileNotFoundError):
+            return False
+
+    def open(self, name):
+        if self.archive is None:
+            return open(os.path.join(self.path, name), "rb")
+
+        try:
+            return self.archive.extractfile(name)
+
+        except KeyError:
+            return self.archive.extractfile("./" + name)
+
+    def json(self, name):
+        with self.open(name) as f:
+            return json.load(f)
+
+    def blob(self, digest):
+        algorithm, _, value = digest.partition(":")
+        return os.path.join("blobs", algorithm, value)
+
+    def load_docker(self):
+        manifest = self.json("manifest.json")
+        self.manifest = manifest[0]
+        self.config = self.json(self.manifest['Config'])
+        self.layers = self.manifest['Layers']
+
+    def load_oci(self):
+        index = self.json("index.json")
+        manifest = self.json(self.blob(index['manifests'][0]['digest']))
+
+        # multi-platform image, pick linux/amd64 or first one
+        while 'manifests' in manifest:
+            selected = manifest['manifests'][0]
+
+            for entry in manifest['manifests']:
+                platform = entry.get('platform', {})
+                if platform.get('os') == 'linux' and platform.get('architecture') == 'amd64':
+                    selected = entry
+                    break
+
+            manifest = self.json(self.blob(selected['digest']))
+
+        self.manifest = manifest
+        self.config = self.json(self.blob(manifest['config']['digest']))
+        self.layers = [self.blob(layer['digest']) for layer in manifest['layers']]
+
+    def layer(self, index):
+        return self.open(self.layers[index])
+
+    def inside(self, rootdir, path):
+        return contained(rootdir, os.path.realpath(os.path.dirname(path)))
+
+    def remove(self, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+
+        elif os.path.lexists(path):
+            os.unlink(path)
+
+    def apply(self, index, rootdir):
+        """
+        Apply layer `index` on top of `rootdir`, layer is read as a stream
+        (compressed or not) and whiteout entries remove files from
+        previous layers
+        """
+        rootdir = os.path.realpath(rootdir)
+        files = 0
+
+        with self.layer(index) as stream:
+            layer = tarfile.open(fileobj=stream, mode="r|*")
+
+            for member in layer:
+                name = os.path.normpath(member.name.lstrip("/"))
+                if name == "." or escaping(name):
+                    continue
+
+                path = os.path.join(rootdir, name)
+                dirname, basename = os.path.split(path)
+
+                # never write through a symlink pointing outside
+                if not self.inside(rootdir, path):
+                    print("[-] layers: skipping unsafe entry: %s" % member.name)
+                    continue
+
+                # never link to (and change) a file outside
+                reason = unsafe(rootdir, member)
+                if reason:
+                    print("[-] layers: skipping %s: %s" % (member.name, reason))
+                    continue
+
+                # opaque directory, hide all previous layers contents
+                if basename == ".wh..wh..opq":
+                    if os.path.isdir(dirname):
+                        for entry in os.listdir(dirname):
+                            self.remove(os.path.join(dirname, entry))
+
+                    continue
+
+                if basename.startswith(".wh."):
+                    self.remove(os.path.join(dirname, basename[4:]))
+                    continue
+
+                # upper layer entry replaces lower layer one, except
+                # directories which are merged
+                if not (member.isdir() and os.path.isdir(path) and not os.path.islink(path)):
+                    self.remove(path)
+
+                member.name = name
+                if member.islnk():
+                    member.linkname = os.path.normpath(member.linkname)
+
+                layer.extract(member, rootdir, numeric_owner=True, **extraction)
+                files += 1
+
+            layer.close()
+
+        return files
+
+    def close(self):
+        if self.archive:
+            self.archive.close()
+
+def escaping(name):
+    """
+    Relative `name` leaving its root (leading '..' component)
+    """
+    return os.path.normpath(name).split(os.sep)[0] == ".."
+
+def contained(rootdir, path):
+    return path == rootdir or path.startswith(rootdir + os.sep)
+
+def unsafe(rootdir, member):
+    """
+    Reason why link `member` can't be extracted into `rootdir`, None
+    if it's safe
+    """
+    if member.islnk():
+        # hardlinks are made on the target itself, it needs
+        # to be an entry already extracted into rootdir
+        if os.path.isabs(member.linkname) or escaping(member.linkname):
+            return "hardlink outside of layer: %s" % member.linkname
+
+        target = os.path.realpath(os.path.join(rootdir, member.linkname))
+        if target == rootdir or not contained(rootdir, target):
+            return "hardlink outside of layer: %s" % member.linkname
+
+    if member.issym() and not os.path.isabs(member.linkname):
+        # absolute targets are resolved against the image root once
+        # mounted, relative ones must not climb above it
+        name = os.path.normpath(member.name.lstrip("/"))
+        if escaping(os.path.join(os.path.dirname(name), member.linkname)):
+            return "symlink outside of layer: %s" % member.linkname
+
+    return None
+
+#
+# layers are root filesystems, owners, permissions and special bits
+# (setuid binaries) need to be kept as they are, the 'tar' and 'data'
+# filters would strip them and refuse absolute symlinks: links are
+# checked while applying, and again here on pythons supporting
+# extraction filters
+#
+def layerfilter(member, rootdir):
+    reason = unsafe(os.path.realpath(rootdir), member)
+    if reason:
+        raise tarfile.FilterError(reason)
+
+    return member
+
+extraction = {}
+if hasattr(tarfile, 'fully_trusted_filter'):
+    extraction['filter'] = layerfilter
+
+class HubChunksReader:
+    """
+    Readable file object over an iterable of chunks (eg: a docker
+    image save stream)
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.offset = 0
+
+    def read(self, size=-1):
+        output = []
+
+        while size != 0:
+            if self.offset == len(self.buffer):
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+
+                self.buffer = chunk
+                self.offset = 0
+                continue
+
+            end = len(self.buffer) if size < 0 else min(len(self.buffer), self.offset + size)
+            output.append(self.buffer[self.offset:end])
+
+            if size > 0:
+                size -= end - self.offset
+
+            self.offset = end
+
+        return b"".join(output)
+
+def export(chunks, layoutdir, diffids, missing):
+    """
+    Write the image layout streamed by `chunks` (docker save) into
+    `layoutdir`, only layers of `missing` diffids are kept, returns
+    amount of files and bytes written
+    """
+    files = 0
+    written = 0
+
+    with tarfile.open(fileobj=HubChunksReader(chunks), mode="r|") as tar:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if os.path.isabs(name) or escaping(name) or name == ".":
+                continue
+
+            path = os.path.join(layoutdir, name)
+
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+                continue
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # legacy layout, duplicated layers link to the first one
+            if member.issym():
+                if not escaping(os.path.join(os.path.dirname(name), member.linkname)):
+                    os.symlink(member.linkname, path)
+
+                continue
+
+            if not member.isfile():
+                continue
+
+            # oci layout, layers blobs are named by their diffid
+            diffid = "sha256:%s" % os.path.basename(name)
+            if name.startswith("blobs/sha256/") and diffid in diffids and diffid not in missing:
+                continue
+
+            # legacy layout, layers are only known once hashed
+            layer = os.path.basename(name) == "layer.tar"
+            hasher = hashlib.sha256()
+            source = tar.extractfile(member)
+
+            with open(path, "wb") as f:
+                for chunk in iter(lambda: source.read(1 << 20), b""):
+                    f.write(chunk)
+
+                    if layer:
+                        hasher.update(chunk)
+
+            if layer and "sha256:%s" % hasher.hexdigest() not in missing:
+                os.unlink(path)
+                continue
+
+            files += 1
+            written += member.size
+
+    return files, written
+
+class HubLayerCache:
+    """
+    Docker layers converted to flists
+
+    Each layer is converted once into its own flist, keyed by the layer
+    diff_id (sha256 of the uncompressed layer tar), an image can then be
+    built by merging its layers flists together.
+
+    Layers which delete files (whiteout entries) can't be represented
+    with a merge, they are only recorded as such
+    """
+    def __init__(self, config, announcer=None, jobid=None, timing=None):
+        self.config = config
+        self.root = config['docker-layers-directory']
+        self.announcer = announcer
+        self.jobid = jobid
+        self.timing = timing
+
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    def name(self, diffid):
+        return diffid.replace("sha256:", "")
+
+    def target(self, diffid):
+        return os.path.join(self.root, "%s.flist" % self.name(diffid))
+
+    def metafile(self, diffid):
+        return os.path.join(self.root, "%s.json" % self.name(diffid))
+
+    def get(self, diffid):
+        """
+        Returns layer information if the layer was already converted
+        """
+        try:
+            with open(self.metafile(diffid), "r") as f:
+                return json.load(f)
+
+        except FileNotFoundError:
+            return None
+
+    def whiteouts(self, rootdir):
+        for root, dirs, files in os.walk(rootdir):
+            for name in files:
+                if name.startswith(".wh."):
+                    return True
+
+        return False
+
+    def build(self, diffid, stream):
+        with layer_lock(diffid):
+            # layer converted by another job meanwhile
+            found = self.get(diffid)
+            if found:
+                return found
+
+            print("[+] layers: converting layer %s" % diffid)
+
+            flist = HubFlist(self.config, self.announcer)
+            if self.jobid:
+                flist.jobid = self.jobid
+
+            # layers stages are accounted to the image build
+            if self.timing:
+                flist.timing = self.timing
+
+            workspace = flist.workspace()
+
+            # a truncated layer would be cached (and reused) for good
+            if flist.unpack_stream(stream, "layer.tar", workspace.name) != 0:
+                print("[-] layers: could not extract layer %s" % diffid)
+                workspace.cleanup()
+                return None
+
+            info = {'diffid': diffid, 'whiteouts': self.whiteouts(workspace.name)}
+
+            if not info['whiteouts']:
+                temp = self.target(diffid) + ".tmp"
+                stats = flist.create(workspace.name, temp)
+
+                if not stats['success']:
+                    if os.path.exists(temp):
+                        os.unlink(temp)
+
+                    workspace.cleanup()
+                    return None
+
+                os.rename(temp, self.target(diffid))
+                info['flist'] = stats['response']
+
+            workspace.cleanup()
+
+            # readers never see a partially written metadata file
+            temp = self.metafile(diffid) + ".tmp"
+
+            with open(temp, "w") as f:
+                f.write(json.dumps(info))
+
+            os.replace(temp, self.metafile(diffid))
+
+            return info
+
+#
+# avoid converting the same layer from two jobs at the same time
+#
+layers_locks = {}
+layers_lock = threading.Lock()
+
+def layer_lock(diffid):
+    with layers_lock:
+        if diffid not in layers_locks:
+            layers_locks[diffid] = threading.Lock()
+
+        return layers_locks[diffid]
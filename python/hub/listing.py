@@ -0,0 +1,65 @@
+import gzip
+import json
+import hashlib
+import threading
+
+try:
+    import brotli
+
+except ImportError:
+    brotli = None
+
+class HubListing:
+    """
+    One listing serialized with its compressed variants
+    """
+    def __init__(self, data):
+        body = (json.dumps(data) + "\n").encode('utf-8')
+
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.variants = {
+            'identity': body,
+            'gzip': gzip.compress(body, 9),
+        }
+
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=9)
+
+    def negotiate(self, accept):
+        """
+        Pick the best variant allowed by `accept` (Accept-Encoding)
+        returns encoding, etag and body
+        """
+        encodings = [name for name in ['br', 'gzip'] if name in self.variants]
+        encoding = accept.best_match(encodings) or 'identity'
+
+        etag = self.etag if encoding == 'identity' else "%s-%s" % (self.etag, encoding)
+
+        return encoding, etag, self.variants[encoding]
+
+class HubListings:
+    """
+    Public listings responses, serialized and compressed once
+    per catalog generation instead of once per request
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, name, builder):
+        with self.lock:
+            generation = self.catalog.generation
+            entry = self.entries.get(name)
+
+            if entry and entry[0] == generation:
+                return entry[1]
+
+        # catalog can change while building, this listing will
+        # then be built again on next request
+        listing = HubListing(builder())
+
+        with self.lock:
+            self.entries[name] = (generation, listing)
+
+        return listing
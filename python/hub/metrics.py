@@ -0,0 +1,186 @@
+import os
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+
+except ImportError:
+    prometheus_client = None
+
+#
+# prometheus metrics, only collected when prometheus_client is installed
+#
+# with more than one worker, PROMETHEUS_MULTIPROC_DIR needs to be set
+# (to an empty directory) before starting the hub, each worker then
+# writes its metrics there and any of them serves the aggregation
+#
+latency = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+seconds = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+sizes = tuple(1 << shift for shift in range(16, 38, 2))
+counts = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+if prometheus_client is not None:
+    Counter = prometheus_client.Counter
+    Gauge = prometheus_client.Gauge
+    Histogram = prometheus_client.Histogram
+
+    #
+    # http requests
+    #
+    request_latency = Histogram(
+        'hub_http_request_duration_seconds', 'Requests latency, until response headers', ['route', 'method'], buckets=latency
+    )
+
+    responses = Counter(
+        'hub_http_responses_total', 'Responses sent', ['route', 'status']
+    )
+
+    #
+    # build stages, see hub.timing
+    #
+    stage_wall = Histogram(
+        'hub_build_stage_seconds', 'Build stage wall time', ['stage'], buckets=seconds
+    )
+
+    stage_cpu = Histogram(
+        'hub_build_stage_cpu_seconds', 'Build stage cpu time (hub and subprocesses)', ['stage'], buckets=seconds
+    )
+
+    stage_read = Histogram(
+        'hub_build_stage_read_bytes', 'Build stage bytes read', ['stage'], buckets=sizes
+    )
+
+    stage_written = Histogram(
+        'hub_build_stage_written_bytes', 'Build stage bytes written', ['stage'], buckets=sizes
+    )
+
+    stage_files = Histogram(
+        'hub_build_stage_files', 'Build stage files processed', ['stage'], buckets=counts
+    )
+
+    #
+    # zflist subprocesses
+    #
+    zflist_spawns = Counter(
+        'hub_zflist_spawns_total', 'zflist processes spawned', ['command']
+    )
+
+    zflist_duration = Histogram(
+        'hub_zflist_duration_seconds', 'zflist processes duration', ['command'], buckets=latency + seconds[7:]
+    )
+
+    #
+    # jobs and events
+    #
+    jobs_gauge = Gauge(
+        'hub_jobs', 'Build jobs queued or running', ['state'], multiprocess_mode='livesum'
+    )
+
+    channels_gauge = Gauge(
+        'hub_notifier_channels', 'Notifier channels (job events queues) opened', multiprocess_mode='livesum'
+    )
+
+    listeners_gauge = Gauge(
+        'hub_notifier_listeners', 'Events streams connected', multiprocess_mode='livesum'
+    )
+
+    #
+    # caches, transfers
+    #
+    checksum_lookups = Counter(
+        'hub_checksum_lookups_total', 'Checksum index lookups', ['result']
+    )
+
+    pull_bytes = Counter(
+        'hub_docker_pull_bytes_total', 'Bytes downloaded by docker pulls'
+    )
+
+    upload_bytes = Counter(
+        'hub_upload_bytes_total', 'Uploaded bytes received', ['kind']
+    )
+
+    upload_throughput = Histogram(
+        'hub_upload_throughput_bytes_per_second', 'Upload (or chunk) receive throughput', ['kind'], buckets=sizes
+    )
+
+def enabled():
+    return prometheus_client is not None
+
+def request(route, method, status, elapsed):
+    if prometheus_client is None:
+        return
+
+    request_latency.labels(route, method).observe(elapsed)
+    responses.labels(route, str(status)).inc()
+
+def stage(entry):
+    """
+    Record one completed build stage (hub.timing.HubStage)
+    """
+    if prometheus_client is None:
+        return
+
+    stage_wall.labels(entry.name).observe(entry.wall)
+    stage_cpu.labels(entry.name).observe(entry.cpu)
+    stage_read.labels(entry.name).observe(entry.read)
+    stage_written.labels(entry.name).observe(entry.written)
+    stage_files.labels(entry.name).observe(entry.files)
+
+def zflist(command, elapsed):
+    if prometheus_client is None:
+        return
+
+    zflist_spawns.labels(command).inc()
+    zflist_duration.labels(command).observe(elapsed)
+
+def jobs(queued, running):
+    if prometheus_client is None:
+        return
+
+    jobs_gauge.labels('queued').set(queued)
+    jobs_gauge.labels('running').set(running)
+
+def channels(amount):
+    if prometheus_client is None:
+        return
+
+    channels_gauge.set(amount)
+
+def listeners(delta):
+    if prometheus_client is None:
+        return
+
+    listeners_gauge.inc(delta)
+
+def checksum(hit):
+    if prometheus_client is None:
+        return
+
+    checksum_lookups.labels('hit' if hit else 'miss').inc()
+
+def pulled(size):
+    if prometheus_client is None:
+        return
+
+    pull_bytes.inc(size)
+
+def uploaded(kind, size, elapsed):
+    if prometheus_client is None:
+        return
+
+    upload_bytes.labels(kind).inc(size)
+
+    if elapsed > 0:
+        upload_throughput.labels(kind).observe(size / elapsed)
+
+def expose():
+    """
+    Returns metrics (text exposition format) and its content-type
+    """
+    registry = prometheus_client.REGISTRY
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
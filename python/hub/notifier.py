@@ -1,54 +1,360 @@
+import re
 import queue
 import json
+import time
+import redis
+import threading
+import collections
+import hub.metrics
+
+class EventChannel:
+    """
+    Events history of one job, each event gets an increasing id and any
+    amount of subscribers can read it, from the beginning or from the
+    last event they received (resume)
+
+    Progress updates are coalesced: consecutive updates share a single
+    slot, replaced by the newer one, history stays small and a slow
+    subscriber only receives the latest state. Producers never block
+    """
+    def __init__(self, rate=4, maxsize=1024):
+        self.interval = (1 / rate) if rate else 0
+        self.events = collections.deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.updated = time.monotonic()
+        self.ended = False
+
+    def put(self, msg, coalesce=False):
+        with self.condition:
+            self.updated = time.monotonic()
+            self.ended = self.ended or msg is None
+            self.sequence += 1
+
+            event = (self.sequence, msg, coalesce)
+
+            # last event is an update as well, replace it in place
+            if coalesce and len(self.events) > 0 and self.events[-1][2]:
+                self.events[-1] = event
+
+            else:
+                self.events.append(event)
+
+            self.condition.notify_all()
+
+    def put_nowait(self, msg):
+        return self.put(msg)
+
+    def next(self, last):
+        # needs to be called with condition held
+        for event in self.events:
+            if event[0] > last:
+                return event
+
+        return None
+
+    def subscribe(self, last=0):
+        return EventSubscriber(self, last)
+
+class EventSubscriber:
+    """
+    One reader of a job channel, progress updates are delivered at most
+    `rate` times per second (an update can still be replaced meanwhile),
+    anything else is sent right away
+    """
+    def __init__(self, channel, last=0):
+        self.channel = channel
+        self.last = last
+        self.delivered = 0
+        self.ended = False
+
+    def get(self, timeout=None):
+        """
+        Returns next event formatted for the wire or None when the job
+        is over, raises queue.Empty if nothing came within `timeout`
+        """
+        if self.ended:
+            return None
+
+        channel = self.channel
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with channel.condition:
+            while True:
+                now = time.monotonic()
+                channel.updated = now
+
+                event = channel.next(self.last)
+                wait = None if deadline is None else deadline - now
+
+                if event is not None:
+                    delay = (self.delivered + channel.interval) - now
+
+                    if not (event[2] and event is channel.events[-1] and delay > 0):
+                        break
+
+                    wait = delay if wait is None else min(wait, delay)
+
+                if wait is not None and wait <= 0:
+                    raise queue.Empty
+
+                channel.condition.wait(wait)
+
+        eventid, msg, coalesce = event
+        self.last = eventid
+
+        if msg is None:
+            self.ended = True
+            return "id: %d\nevent: end\ndata: {}\n\n" % eventid
+
+        if coalesce:
+            self.delivered = time.monotonic()
+
+        return "id: %d\n%s" % (eventid, msg)
 
 class EventNotifier:
-    def __init__(self):
+    def __init__(self, config=None):
         self.listeners = {}
+        self.rate = (config or {}).get('notifier-rate', 4)
+        self.history = (config or {}).get('notifier-history', 1024)
 
     def initialize(self, id):
-        q = queue.Queue(maxsize=8192)
+        q = EventChannel(self.rate, self.history)
         self.listeners[id] = q
+        hub.metrics.channels(len(self.listeners))
         return q
 
     def error(self, msg):
         return {"status": "error", "message": msg}
 
-    # flag this id as ended, should be cleaned up later
+    # flag this id as ended, should be cleaned up later, the channel
+    # can already be expired (job queued longer than channels ttl)
     def finalize(self, id):
-        self.listeners[id].put_nowait(None)
+        channel = self.listeners.get(id)
+        if channel is None:
+            return False
+
+        channel.put(None)
         return True
 
     # clean the task id
     def terminate(self, id):
         print("[+] notify: cleaning up: %s" % id)
-        del self.listeners[id]
+        self.listeners.pop(id, None)
+        hub.metrics.channels(len(self.listeners))
         return True
 
-    # push an object to a channel
+    # drop channels without activity since `ttl` seconds, finished
+    # or not, returns the amount of channels dropped
+    def expire(self, ttl):
+        limit = time.monotonic() - ttl
+        expired = 0
+
+        for id, channel in list(self.listeners.items()):
+            if channel.updated > limit:
+                continue
+
+            # release a listener still waiting on it
+            if not channel.ended:
+                channel.put(None)
+
+            self.terminate(id)
+            expired += 1
+
+        return expired
+
+    # push an object to a channel, progress updates can be coalesced
     def push(self, id, item):
-        return self.announce(id, json.dumps(item))
+        return self.announce(id, json.dumps(item), item.get('status') == 'update')
 
     # returns pushable object over the wire
     def raw(self, item):
         return self.format(json.dumps(item))
 
-    # grab queue channel if exists
-    def listen(self, id):
+    # subscribe to a channel if exists, after event id `last` if set
+    def listen(self, id, last=None):
         if id not in self.listeners:
             return None
 
-        return self.listeners[id]
+        try:
+            last = int(last or 0)
+
+        except ValueError:
+            last = 0
+
+        return self.listeners[id].subscribe(last)
 
     def format(self, data):
         return "data: %s\n\n" % data
 
-    def announce(self, id, msg):
+    def announce(self, id, msg, coalesce=False):
         # print(id, msg)
         msg = self.format(msg)
 
         if id not in self.listeners:
             return None
 
-        self.listeners[id].put_nowait(msg)
+        self.listeners[id].put(msg, coalesce)
+
+class RedisEventListener:
+    """
+    Reads events of one job from its redis stream, starting from
+    the first event (late subscribers receive the whole history) or
+    after stream entry `last` (resume)
+    """
+    def __init__(self, conn, key, last="0", block=5000):
+        self.conn = conn
+        self.key = key
+        self.block = block
+        self.last = last
+        self.buffer = []
+        self.ended = False
+
+    def get(self, timeout=None):
+        """
+        Returns next event formatted for the wire or None when the job
+        is over, raises queue.Empty if nothing came within `timeout`
+        """
+        if self.ended:
+            return None
+
+        block = self.block if timeout is None else max(1, int(timeout * 1000))
+
+        while len(self.buffer) == 0:
+            response = self.conn.xread({self.key: self.last}, block=block, count=64)
+
+            # job history expired while waiting
+            if not response and not self.conn.exists(self.key):
+                return None
+
+            if not response and timeout is not None:
+                raise queue.Empty
+
+            for stream, entries in response:
+                for entryid, fields in entries:
+                    self.last = entryid
+
+                    # skip channel initialization marker
+                    if b'data' in fields or b'end' in fields:
+                        self.buffer.append((entryid, fields))
+
+        entryid, fields = self.buffer.pop(0)
+        entryid = entryid.decode('utf-8')
+
+        if b'end' in fields:
+            self.ended = True
+            return "id: %s\nevent: end\ndata: {}\n\n" % entryid
+
+        return "id: %s\n%s" % (entryid, fields[b'data'].decode('utf-8'))
+
+class RedisEventNotifier(EventNotifier):
+    """
+    Job events stored on redis streams, any process (or host) can
+    produce or listen events of any job
+    """
+    def __init__(self, config):
+        self.conn = redis.Redis(
+            config['notifier-redis-host'],
+            config.get('notifier-redis-port', 6379),
+            password=config.get('notifier-redis-pass') or None
+        )
+
+        self.prefix = config.get('notifier-redis-prefix', "hub:events:")
+        self.ttl = config.get('notifier-redis-ttl', 3600)
+        self.maxlen = 8192
+
+        # progress updates are throttled before reaching redis, the
+        # latest one skipped is kept and written before next event
+        rate = config.get('notifier-rate', 4)
+        self.interval = (1 / rate) if rate else 0
+        self.throttle = {}
+        self.lock = threading.Lock()
+
+    def key(self, id):
+        return self.prefix + id
+
+    def append(self, id, fields):
+        pipe = self.conn.pipeline()
+        pipe.xadd(self.key(id), fields, maxlen=self.maxlen, approximate=True)
+        pipe.expire(self.key(id), self.ttl)
+        pipe.execute()
+
+    def initialize(self, id):
+        self.append(id, {'init': 1})
+        return self.listen(id)
+
+    # write pending throttled update (if any) of this id
+    def flush(self, id):
+        with self.lock:
+            last, pending = self.throttle.pop(id, (0, None))
+
+        if pending:
+            self.append(id, {'data': pending})
+
+    # flag this id as ended, history is kept until expiration
+    def finalize(self, id):
+        self.flush(id)
+        self.append(id, {'end': 1})
+        return True
+
+    # history is kept for late subscribers, it will expire by itself
+    def terminate(self, id):
+        with self.lock:
+            self.throttle.pop(id, None)
+
+        return True
+
+    # streams expire by themselves, only drop throttling state
+    def expire(self, ttl):
+        limit = time.monotonic() - ttl
+
+        with self.lock:
+            expired = [id for id, (last, pending) in self.throttle.items() if last < limit]
+
+            for id in expired:
+                self.throttle.pop(id)
+
+        return len(expired)
+
+    def listen(self, id, last=None):
+        if not self.conn.exists(self.key(id)):
+            return None
+
+        # resume only from a valid stream entry id
+        if not last or not re.match(r"^[0-9]+-[0-9]+$", last):
+            last = "0"
+
+        return RedisEventListener(self.conn, self.key(id), last)
+
+    def announce(self, id, msg, coalesce=False):
+        msg = self.format(msg)
+
+        if coalesce:
+            now = time.monotonic()
+
+            with self.lock:
+                last, pending = self.throttle.get(id, (0, None))
+
+                if now - last < self.interval:
+                    self.throttle[id] = (last, msg)
+                    return None
+
+                self.throttle[id] = (now, None)
+
+        else:
+            self.flush(id)
+
+        if not self.conn.exists(self.key(id)):
+            return None
+
+        self.append(id, {'data': msg})
 
+def create(config):
+    """
+    Create notifier based on 'notifier-backend' setting
+    """
+    if config.get('notifier-backend', 'memory') == 'redis':
+        print("[+] notify: using redis backend: %s" % config['notifier-redis-host'])
+        return RedisEventNotifier(config)
 
+    return EventNotifier(config)
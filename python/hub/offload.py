@@ -0,0 +1,24 @@
+try:
+    import gevent
+    from gevent import monkey
+
+except ImportError:
+    gevent = None
+
+def cooperative():
+    """
+    Running on gevent workers, threads are greenlets sharing one thread
+    """
+    return gevent is not None and monkey.is_module_patched('threading')
+
+def run(func, *args):
+    """
+    Call blocking `func` (cpu bound or slow i/o), on gevent native
+    threads pool with cooperative workers, requests and events streams
+    keep being served meanwhile. `func` must not use patched primitives
+    (locks, events, subprocesses) nor notify anything
+    """
+    if not cooperative():
+        return func(*args)
+
+    return gevent.get_hub().threadpool.apply(func, args)
@@ -0,0 +1,151 @@
+import os
+import time
+import shutil
+import weakref
+import threading
+import traceback
+import collections
+import hub.session
+
+#
+# temporary directories currently used by this process, they are
+# never reaped, whatever their age
+#
+active = weakref.WeakValueDictionary()
+
+def track(tmpdir):
+    active[os.path.realpath(tmpdir.name)] = tmpdir
+    return tmpdir
+
+class HubReaper:
+    """
+    Background cleanup of everything a crashed or abandoned job can
+    leave behind: notifier channels nobody listens to, build workspaces
+    and docker temporary directories, uploaded source files
+
+    Scratch entries are removed when they were not modified for
+    'reaper-age' seconds and are not used by this process
+    """
+    def __init__(self, config, announcer):
+        self.config = config
+        self.announcer = announcer
+        self.interval = config.get('reaper-interval', 300)
+        self.age = config.get('reaper-age', 86400)
+        self.channels = config.get('notifier-channels-ttl', 3600)
+
+        self.lock = threading.Lock()
+        self.reclaimed = collections.Counter()
+        self.last = None
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return False
+
+        print("[+] reaper: cleaning up every %d seconds" % self.interval)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+        return True
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                self.reap()
+
+            except Exception:
+                print(traceback.format_exc())
+
+    def size(self, path):
+        if not os.path.isdir(path) or os.path.islink(path):
+            return os.lstat(path).st_size
+
+        total = 0
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+
+                except FileNotFoundError:
+                    pass
+
+        return total
+
+    def expired(self, directory):
+        """
+        Entries of `directory` not modified since 'reaper-age' seconds
+        """
+        if not os.path.isdir(directory):
+            return
+
+        limit = time.time() - self.age
+
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+
+            # keep placeholders (.keep) and directories in use
+            if name.startswith(".") or os.path.realpath(path) in active:
+                continue
+
+            try:
+                if os.lstat(path).st_mtime < limit:
+                    yield path
+
+            except FileNotFoundError:
+                continue
+
+    def remove(self, path, kind):
+        try:
+            size = self.size(path)
+
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+
+            else:
+                os.unlink(path)
+
+        except OSError as e:
+            print("[-] reaper: could not remove %s: %s" % (path, e))
+            return
+
+        print("[+] reaper: removed stale %s: %s" % (kind, path))
+
+        with self.lock:
+            self.reclaimed[kind] += 1
+            self.reclaimed['bytes'] += size
+
+    def reap(self):
+        # long-lived sessions of this process are in use, reapers
+        # of other processes only see their modification time
+        hub.session.refresh()
+
+        channels = self.announcer.expire(self.channels)
+
+        with self.lock:
+            self.reclaimed['channels'] += channels
+
+        # flist and docker work directories can be the same one
+        workdirs = set([self.config['flist-work-directory'], self.config['docker-work-directory']])
+
+        for workdir in workdirs:
+            for path in self.expired(workdir):
+                self.remove(path, 'workspaces')
+
+        for path in self.expired(self.config['upload-directory']):
+            self.remove(path, 'distfiles')
+
+        with self.lock:
+            self.last = time.time()
+
+    def dump(self):
+        with self.lock:
+            return {
+                'channels': self.reclaimed['channels'],
+                'workspaces': self.reclaimed['workspaces'],
+                'distfiles': self.reclaimed['distfiles'],
+                'bytes': self.reclaimed['bytes'],
+                'last': int(self.last) if self.last else None,
+            }
@@ -0,0 +1,25 @@
+import threading
+
+#
+# objects shared by all users of a process (indexes, caches, pools),
+# one instance per kind and key (eg: a class and its database file)
+#
+instances = {}
+instances_lock = threading.Lock()
+
+def instance(kind, key, factory):
+    """
+    Instance of `kind` for `key`, created by `factory()` on first use
+    """
+    with instances_lock:
+        if (kind, key) not in instances:
+            instances[(kind, key)] = factory()
+
+        return instances[(kind, key)]
+
+def everyone(kind):
+    """
+    All instances of `kind` created so far
+    """
+    with instances_lock:
+        return [value for (found, key), value in instances.items() if found is kind]
@@ -0,0 +1,1540 @@
+import os
+import sys
+import shutil
+import tempfile
+import json
+import queue
+import threading
+import time
+import hub.itsyouonline
+import hub.threebot
+import hub.security
+import hub.catalog
+import hub.notifier
+import hub.timing
+import hub.metrics
+from stat import *
+from flask import Flask, Blueprint, Response, request, redirect, url_for, render_template, abort, make_response, session, g
+from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
+from werkzeug.http import parse_content_range_header
+from werkzeug.middleware.proxy_fix import ProxyFix
+# from werkzeug.contrib.fixers import ProxyFix
+from werkzeug.wrappers import Request
+from hub.flist import HubPublicFlist, HubFlist
+from hub.docker import HubDocker
+from hub.notifier import EventNotifier
+from hub.jobs import HubJobs
+from hub.reaper import HubReaper
+from hub.listing import HubListings
+from hub.uploads import HubUploads, HubStreamingReceiver
+
+#
+# shared runtime objects, initialized by create_app
+#
+config = None
+announcer = None
+jobs = None
+catalog = None
+listings = None
+uploads = None
+reaper = None
+
+blueprint = Blueprint('hub', __name__)
+rootpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+
+######################################
+#
+# TEMPLATES MANIPULATION
+#
+######################################
+def allowed_file(filename, validate=False):
+    if validate:
+        return filename.endswith(".flist")
+
+    for ext in config['allowed-extensions']:
+        if filename.endswith(ext):
+            return True
+
+    return False
+
+def globalTemplate(filename, args):
+    args['debug'] = config['debug']
+
+    if 'username' in session:
+        args['username'] = session['username']
+
+    if 'accounts' in session:
+        args['accounts'] = session['accounts']
+
+    return render_template(filename, **args)
+
+def file_from_flist(filename):
+    cleanfilename = filename
+    for ext in config['allowed-extensions']:
+        if cleanfilename.endswith(ext):
+            cleanfilename = cleanfilename[:-len(ext)]
+
+    return cleanfilename
+
+def uploadSuccess(flistname, filescount, home, username=None):
+    if username is None:
+        username = session['username']
+
+    settings = {
+        'username': username,
+        'accounts': session['accounts'],
+        'flistname': flistname,
+        'filescount': 0,
+        'flisturl': "%s/%s/%s" % (config['public-website'], username, flistname),
+        'ardbhost': 'zdb://%s:%d' % (config['backend-public-host'], config['backend-public-port']),
+    }
+
+    return globalTemplate("success.html", settings)
+
+def internalRedirect(target, error=None, extra={}):
+    settings = {
+        'username': None,
+        'accounts': [],
+    }
+
+    settings.update(extra)
+
+    if error:
+        settings['error'] = error
+
+    return globalTemplate(target, settings)
+
+def flist_merge_post():
+    sources = request.form.getlist('flists[]')
+    target = request.form['name']
+
+    return flist_merge_data(sources, target)
+
+def flist_merge_data(sources, target):
+    data = {}
+    data['error'] = None
+    data['sources'] = sources
+    data['target'] = target
+
+    if not isinstance(sources, list):
+        data['error'] = 'malformed json request'
+        return data
+
+    if len(data['sources']) == 0:
+        data['error'] = "no source found"
+        return data
+
+    # ensure .flist extension to each sources
+    fsources = []
+    for source in data['sources']:
+        # missing username/filename
+        if "/" not in source:
+            data['error'] = "malformed source filename"
+            return data
+
+        cleaned = source if source.endswith(".flist") else source + ".flist"
+        fsources.append(cleaned)
+
+    data['sources'] = fsources
+
+    # ensure each sources exists
+    for source in data['sources']:
+        temp = source.split("/")
+        item = HubPublicFlist(config, temp[0], temp[1])
+
+        if not item.file_exists:
+            data['error'] = "%s does not exists" % source
+            return data
+
+    if not data['target']:
+        data['error'] = "missing build (target) name"
+        return data
+
+    if "/" in data['target']:
+        data['error'] = "build name not allowed"
+        return data
+
+    if not data['target'].endswith('.flist'):
+        data['target'] += '.flist'
+
+    return data
+
+
+######################################
+#
+# ROUTING ACTIONS
+#
+######################################
+
+@blueprint.route('/_iyo_callback')
+def iyo_callback():
+    return internalRedirect("users.html")
+
+@blueprint.route('/logout')
+def logout():
+    hub.security.invalidate()
+    return internalRedirect("users.html")
+
+@blueprint.route('/login-method')
+def login_method():
+    return internalRedirect("logins.html")
+
+@blueprint.route('/login-iyo')
+@hub.itsyouonline.requires_auth()
+def login_iyo():
+    return internalRedirect("users.html")
+
+@blueprint.route('/upload', methods=['GET', 'POST'])
+@hub.security.protected()
+def upload_file():
+    username = session['username']
+
+    if request.method == 'POST':
+        response = api_flist_upload_prepare(request, username)
+        return response
+
+        """
+        if response['status'] == 'success':
+            return uploadSuccess(response['flist'], response['stats'], response['home'])
+
+        if response['status'] == 'error':
+            return internalRedirect("upload.html", response['message'])
+        """
+
+    return internalRedirect("upload.html")
+
+@blueprint.route('/upload-flist', methods=['GET', 'POST'])
+@hub.security.protected()
+def upload_file_flist():
+    username = session['username']
+
+    if request.method == 'POST':
+        response = api_flist_upload(request, username, validate=True)
+
+        if response['status'] == 'success':
+            return uploadSuccess(response['flist'], response['stats'], response['home'])
+
+        if response['status'] == 'error':
+            return internalRedirect("upload-flist.html", response['message'])
+
+    return internalRedirect("upload-flist.html")
+
+@blueprint.route('/merge', methods=['GET', 'POST'])
+@hub.security.protected()
+def flist_merge():
+    username = session['username']
+
+    if request.method == 'POST':
+        data = flist_merge_post()
+        print(data)
+
+        if data['error']:
+            return internalRedirect("merge.html", data['error'])
+
+        flist = HubPublicFlist(config, username, data['target'])
+        status = flist.merge(data['sources'])
+
+        if not status == True:
+            variables = {'error': status}
+            return globalTemplate("merge.html", variables)
+
+        return uploadSuccess(data['target'], 0, data['target'])
+
+    # Merge page
+    return internalRedirect("merge.html")
+
+@blueprint.route('/docker-convert', methods=['GET', 'POST'])
+@hub.security.protected()
+def docker_handler():
+    username = session['username']
+
+    if request.method == 'POST':
+        if not request.form.get("docker-input"):
+            return internalRedirect("docker.html", "missing docker image name")
+
+        docker = HubDocker(config, announcer)
+        print("[+] docker converter id: %s" % docker.jobid)
+
+        job = jobs.submit(docker.jobid, username, "docker", docker.convert, (request.form.get("docker-input"), username, ))
+        if job is None:
+            announcer.terminate(docker.jobid)
+            return internalRedirect("docker.html", "too many jobs queued, please try again later")
+
+        return internalRedirect("docker-progress.html", None, {'jobid': docker.jobid})
+
+    # Docker page
+    return internalRedirect("docker.html")
+
+######################################
+#
+# ROUTING NAVIGATION
+#
+######################################
+@blueprint.route('/')
+def show_users():
+    return globalTemplate("users.html", {})
+
+@blueprint.route('/<username>')
+def show_user(username):
+    flist = HubPublicFlist(config, username, "unknown")
+    if not flist.user_exists:
+        abort(404)
+
+    return globalTemplate("user.html", {'targetuser': username})
+
+@blueprint.route('/<username>/<flist>.md')
+def show_flist_md(username, flist):
+    flist = HubPublicFlist(config, username, flist)
+    if not flist.file_exists:
+        abort(404)
+
+    variables = {
+        'targetuser': username,
+        'flistname': flist.filename,
+        'flisturl': "%s/%s/%s" % (config['public-website'], username, flist.filename),
+        'ardbhost': 'zdb://%s:%d' % (config['backend-public-host'], config['backend-public-port']),
+        'checksum': flist.checksum
+    }
+
+    return globalTemplate("preview.html", variables)
+
+@blueprint.route('/<username>/<flist>.txt')
+def show_flist_txt(username, flist):
+    flist = HubPublicFlist(config, username, flist)
+    if not flist.file_exists:
+        abort(404)
+
+    etag = "%s-txt" % flist.checksum
+    notmodified = unchanged('flist-info', etag)
+    if notmodified:
+        return notmodified
+
+    text  = "File:     %s\n" % flist.filename
+    text += "Uploader: %s\n" % username
+    text += "Source:   %s/%s/%s\n" % (config['public-website'], username, flist.filename)
+    text += "Storage:  zdb://%s:%d\n" % (config['backend-public-host'], config['backend-public-port'])
+    text += "Checksum: %s\n" % flist.checksum
+
+    response = make_response(text)
+    response.headers["Content-Type"] = "text/plain"
+
+    return cached(response, 'flist-info', etag)
+
+@blueprint.route('/<username>/<flist>.json')
+def show_flist_json(username, flist):
+    flist = HubPublicFlist(config, username, flist)
+    if not flist.file_exists:
+        abort(404)
+
+    etag = "%s-json" % flist.checksum
+    notmodified = unchanged('flist-info', etag)
+    if notmodified:
+        return notmodified
+
+    data = {
+        'flist': flist.filename,
+        'uploader': username,
+        'source': "%s/%s/%s" % (config['public-website'], username, flist.filename),
+        'storage': "zdb://%s:%d" % (config['backend-public-host'], config['backend-public-port']),
+        'checksum': flist.checksum
+    }
+
+    response = make_response(json.dumps(data) + "\n")
+    response.headers["Content-Type"] = "application/json"
+
+    return cached(response, 'flist-info', etag)
+
+@blueprint.route('/<username>/<flist>.flist')
+def download_flist(username, flist):
+    flist = HubPublicFlist(config, username, flist)
+    path = os.path.realpath(flist.target)
+
+    # symlinks are followed, but only inside public directory
+    if not path.startswith(os.path.realpath(flist.rootpath) + os.sep) or not os.path.isfile(path):
+        abort(404)
+
+    stat = os.stat(path)
+
+    response = Response(wrap_file(request.environ, open(path, "rb")), mimetype="application/octet-stream", direct_passthrough=True)
+    response.content_length = stat.st_size
+
+    return cached(response, 'flist', flist.checksum, stat.st_mtime, ranges=True)
+
+@blueprint.route('/<username>/<flist>.flist.md5')
+def checksum_flist(username, flist):
+    flist = HubPublicFlist(config, username, flist)
+    hash = flist.checksum
+
+    if not hash:
+        abort(404)
+
+    etag = "%s-md5" % hash
+    notmodified = unchanged('flist-info', etag)
+    if notmodified:
+        return notmodified
+
+    response = make_response(hash + "\n")
+    response.headers["Content-Type"] = "text/plain"
+
+    return cached(response, 'flist-info', etag)
+
+@blueprint.route('/search')
+def search_flist():
+    return globalTemplate("search.html", {})
+
+
+######################################
+#
+# ROUTING API
+#
+######################################
+
+#
+# Public API
+#
+@blueprint.route('/api/flist')
+def api_list():
+    if pagination_requested():
+        return listing_page(lambda user, entry: "%s/%s" % (user, entry['name']))
+
+    return listing_response("flists", catalog.flists)
+
+@blueprint.route('/api/fileslist')
+def api_list_files():
+    if pagination_requested():
+        return listing_page(lambda user, entry: dict(entry, repository=user))
+
+    return listing_response("fileslist", api_fileslist)
+
+@blueprint.route('/api/repositories')
+def api_list_repositories():
+    return listing_response("repositories", api_repositories)
+
+@blueprint.route('/api/flist/<username>')
+def api_user_contents(username):
+    flist = HubPublicFlist(config, username, "unknown")
+    if not flist.user_exists:
+        abort(404)
+
+    contents = api_user_contents(username, flist.user_path)
+    if contents is None:
+        abort(404)
+
+    response = make_response(json.dumps(contents) + "\n")
+    response.headers["Content-Type"] = "application/json"
+
+    return cached(response, 'listing')
+
+@blueprint.route('/api/flist/<username>/<flist>', methods=['GET', 'INFO'])
+def api_inspect(username, flist):
+    flist = HubPublicFlist(config, username, flist)
+
+    if not flist.user_exists:
+        return api_response("user not found", 404)
+
+    if not flist.file_exists:
+        return api_response("source not found", 404)
+
+    if request.method == 'GET':
+        etag = "%s-contents" % flist.checksum
+        notmodified = unchanged('contents', etag)
+        if notmodified:
+            return notmodified
+
+        contents = api_contents(flist)
+
+    if request.method == 'INFO':
+        etag = None
+        contents = api_flist_info(flist)
+
+    response = make_response(json.dumps(contents) + "\n")
+    response.headers["Content-Type"] = "application/json"
+
+    return cached(response, 'contents', etag)
+
+@blueprint.route('/api/flist/<username>/<flist>/light', methods=['GET'])
+def api_inspect_light(username, flist):
+    flist = HubPublicFlist(config, username, flist)
+
+    if not flist.user_exists:
+        return api_response("user not found", 404)
+
+    if not flist.file_exists:
+        return api_response("source not found", 404)
+
+    contents = api_flist_info(flist)
+
+    response = make_response(json.dumps(contents) + "\n")
+    response.headers["Content-Type"] = "application/json"
+
+    return cached(response, 'contents')
+
+@blueprint.route('/api/flist/<username>/<flist>/metadata')
+def api_readme(username, flist):
+    flist = HubPublicFlist(config, username, flist)
+
+    if not flist.user_exists:
+        return api_response("user not found", 404)
+
+    if not flist.file_exists:
+        return api_response("source not found", 404)
+
+    etag = "%s-metadata" % flist.checksum
+    notmodified = unchanged('contents', etag)
+    if notmodified:
+        return notmodified
+
+    readme = api_flist_md(flist)
+    if readme is None:
+        return api_response("could not read flist metadata", 500)
+
+    response = make_response(json.dumps(readme) + "\n")
+    response.headers["Content-Type"] = "application/json"
+
+    return cached(response, 'contents', etag)
+
+@blueprint.route('/api/jobs/<jobid>', methods=['GET'])
+def api_job_status(jobid):
+    job = jobs.get(jobid)
+    if job is None:
+        return api_response("job not found", 404)
+
+    return api_response(extra=job.dump())
+
+@blueprint.route('/api/status', methods=['GET'])
+def api_status():
+    status = {
+        'jobs': jobs.stats(),
+        'reclaimed': reaper.dump(),
+    }
+
+    return api_response(extra=status)
+
+@blueprint.route('/api/flist/me', methods=['GET'])
+@hub.itsyouonline.requires_auth()
+def api_my_myself():
+    username = session['username']
+
+    return api_response(extra={"username": username})
+
+
+@blueprint.route('/api/flist/me/<flist>', methods=['GET', 'DELETE'])
+@hub.itsyouonline.requires_auth()
+def api_my_inspect(flist):
+    username = session['username']
+
+    if request.method == 'DELETE':
+        return api_delete(username, flist)
+
+    return api_inspect(username, flist)
+
+@blueprint.route('/api/flist/me/<source>/link/<linkname>', methods=['GET'])
+@hub.itsyouonline.requires_auth()
+def api_my_symlink(source, linkname):
+    username = session['username']
+
+    return api_symlink(username, source, linkname)
+
+@blueprint.route('/api/flist/me/<linkname>/crosslink/<repository>/<sourcename>', methods=['GET'])
+@hub.itsyouonline.requires_auth()
+def api_my_crosssymlink(linkname, repository, sourcename):
+    username = session['username']
+
+    return api_cross_symlink(username, repository, sourcename, linkname)
+
+@blueprint.route('/api/flist/me/<source>/rename/<destination>')
+@hub.itsyouonline.requires_auth()
+def api_my_rename(source, destination):
+    username = session['username']
+    flist = HubPublicFlist(config, username, source)
+    destflist = HubPublicFlist(config, username, destination)
+
+    if not flist.user_exists:
+        return api_response("user not found", 404)
+
+    if not flist.file_exists:
+        return api_response("source not found", 404)
+
+    flist.rename(destflist)
+
+    return api_response()
+
+@blueprint.route('/api/flist/me/promote/<sourcerepo>/<sourcefile>/<localname>', methods=['GET'])
+@hub.itsyouonline.requires_auth()
+def api_my_promote(sourcerepo, sourcefile, localname):
+    username = session['username']
+
+    return api_promote(username, sourcerepo, sourcefile, localname)
+
+@blueprint.route('/api/flist/me/upload', methods=['POST'])
+@hub.itsyouonline.requires_auth()
+def api_my_upload():
+    username = session['username']
+
+    response = api_flist_upload(request, username)
+    if response['status'] == 'success':
+        if config['debug']:
+            return api_response(extra={'name': response['flist'], 'files': response['stats'], 'digests': response['digests'], 'timing': response['timing']})
+
+        else:
+            return api_response(extra={'name': response['flist'], 'files': response['stats'], 'digests': response['digests']})
+
+    if response['status'] == 'error':
+        return api_response(response['message'], response.get('code', 500))
+
+#
+# resumable (chunked) uploads
+#
+@blueprint.route('/api/flist/me/upload/sessions', methods=['POST'])
+@hub.itsyouonline.requires_auth()
+def api_my_upload_session_create():
+    username = session['username']
+    settings = request.get_json(silent=True, force=True) or request.form
+
+    filename = secure_filename(settings.get('filename', ''))
+    if not filename or not allowed_file(filename):
+        return api_response("this file is not allowed", 400)
+
+    try:
+        size = int(settings.get('size', 0))
+
+    except ValueError:
+        size = 0
+
+    if size <= 0:
+        return api_response("invalid archive size", 400)
+
+    meta = uploads.create(username, filename, size)
+    usession, meta = uploads.get(meta['id'], username)
+
+    return api_response(extra=uploads.status(usession, meta))
+
+@blueprint.route('/api/flist/me/upload/sessions/<sessionid>', methods=['GET', 'PUT', 'DELETE'])
+@hub.itsyouonline.requires_auth()
+def api_my_upload_session(sessionid):
+    username = session['username']
+
+    usession, meta = uploads.get(sessionid, username)
+    if usession is None:
+        return api_response("upload session not found", 404)
+
+    if request.method == 'DELETE':
+        uploads.remove(usession)
+        return api_response()
+
+    if request.method == 'PUT':
+        # Content-Range: bytes <start>-<end>/<size>
+        crange = parse_content_range_header(request.headers.get('Content-Range'))
+        if crange is None or crange.units != 'bytes' or crange.start is None:
+            return api_response("missing or invalid content-range", 400)
+
+        if crange.length is not None and crange.length != meta['size']:
+            return api_response("content-range size mismatch", 400)
+
+        try:
+            meta = uploads.receive(usession, meta, request.stream, crange.start, crange.stop)
+
+        except ValueError as e:
+            return api_response(str(e), 400)
+
+    return api_response(extra=uploads.status(usession, meta))
+
+@blueprint.route('/api/flist/me/upload/sessions/<sessionid>/finalize', methods=['POST'])
+@hub.itsyouonline.requires_auth()
+def api_my_upload_session_finalize(sessionid):
+    username = session['username']
+
+    usession, meta = uploads.get(sessionid, username)
+    if usession is None:
+        return api_response("upload session not found", 404)
+
+    if not usession.complete(meta):
+        return api_response("upload not complete", 400, uploads.status(usession, meta))
+
+    if meta.get('jobid'):
+        return api_response("upload already finalized", 409, {'jobid': meta['jobid']})
+
+    digests = usession.digests(meta)
+    expected = request.get_json(silent=True, force=True) or {}
+
+    for name in ['md5', 'sha256']:
+        if expected.get(name) and expected[name].lower() != digests[name]:
+            uploads.remove(usession)
+            return api_response("%s mismatch, upload discarded" % name, 400, digests)
+
+    flist = HubPublicFlist(config, username, file_from_flist(meta['filename']), announcer)
+
+    # flag session before the build removes it, concurrent
+    # finalize requests (any worker) only build it once
+    meta = usession.claim(flist.raw.jobid)
+    if meta['jobid'] != flist.raw.jobid:
+        return api_response("upload already finalized", 409, {'jobid': meta['jobid']})
+
+    flist.raw.newtask()
+
+    def build():
+        try:
+            info = flist.create_archive(usession.partfile)
+            info['digests'] = digests
+            return info
+
+        finally:
+            uploads.remove(usession)
+
+    print("[+] flist creation id: %s (upload %s)" % (flist.raw.jobid, sessionid))
+
+    job = jobs.submit(flist.raw.jobid, username, "upload", build)
+    if job is None:
+        announcer.terminate(flist.raw.jobid)
+        usession.claim(None)
+
+        return api_response("too many jobs queued, please try again later", 503)
+
+    return api_response(extra={'jobid': flist.raw.jobid, 'digests': digests})
+
+@blueprint.route('/api/flist/me/upload-flist', methods=['POST'])
+@hub.itsyouonline.requires_auth()
+def api_my_upload_flist():
+    username = session['username']
+
+    response = api_flist_upload(request, username, validate=True)
+    if response['status'] == 'success':
+        if config['debug']:
+            return api_response(extra={'name': response['flist'], 'files': response['stats'], 'timing': response['timing']})
+
+        else:
+            return api_response(extra={'name': response['flist'], 'files': response['stats']})
+
+    if response['status'] == 'error':
+        return api_response(response['message'], 500)
+
+@blueprint.route('/api/flist/me/merge/<target>', methods=['POST'])
+@hub.itsyouonline.requires_auth()
+def api_my_merge(target):
+    username = session['username']
+
+    sources = request.get_json(silent=True, force=True)
+    data = flist_merge_data(sources, target)
+
+    if data['error'] != None:
+        return api_response(data['error'], 500)
+
+    flist = HubPublicFlist(config, username, data['target'])
+    status = flist.merge(data['sources'])
+
+    if not status == True:
+        return api_response(status, 500)
+
+    return api_response()
+
+@blueprint.route('/api/flist/me/docker', methods=['POST'])
+@hub.itsyouonline.requires_auth()
+def api_my_docker():
+    username = session['username']
+
+    if not request.form.get("image"):
+        return api_response("missing docker image name", 400)
+
+    source = None
+
+    # image layout uploaded (docker save or oci layout tarball)
+    # converting it doesn't need to pull anything
+    if 'file' in request.files and request.files['file'].filename:
+        # unique path, same named uploads can be converted concurrently
+        fd, source = tempfile.mkstemp(prefix="docker-", suffix=".tar", dir=config['upload-directory'])
+        os.close(fd)
+
+        docker = HubDocker(config, announcer, daemon=False)
+        image = request.form.get("image")
+
+        with docker.timing.stage('save') as stage:
+            request.files['file'].save(source)
+            stage.files = 1
+            stage.written = os.path.getsize(source)
+
+        def convert():
+            try:
+                return docker.convert_archive(source, image, username)
+
+            finally:
+                os.unlink(source)
+
+        job = jobs.submit(docker.jobid, username, "docker", convert)
+
+        if job is None:
+            os.unlink(source)
+
+    else:
+        docker = HubDocker(config, announcer)
+        job = jobs.submit(docker.jobid, username, "docker", docker.convert, (request.form.get("image"), username, ))
+
+    if job is not None:
+        job.wait()
+
+    if job is None:
+        announcer.terminate(docker.jobid)
+        return api_response("too many jobs queued, please try again later", 503)
+
+    response = job.result
+
+    if job.status == 'failed' and response is None:
+        return api_response(job.error, 500)
+
+    if response['status'] == 'success':
+        if config['debug']:
+            return api_response(extra={'name': response['flist'], 'timing': response['timing']})
+
+        return api_response(extra={'name': response['flist']})
+
+    if response['status'] == 'error':
+        return api_response(response['message'], 500)
+
+    return api_response("unexpected docker convert error", 500)
+
+
+######################################
+#
+# API IMPLEMENTATION
+#
+######################################
+def api_delete(username, source):
+    flist = HubPublicFlist(config, username, source)
+
+    if not flist.user_exists:
+        return api_response("user not found", 404)
+
+    if not flist.file_exists:
+        return api_response("source not found", 404)
+
+    flist.remove()
+
+    return api_response()
+
+def api_symlink(username, source, linkname):
+    flist = HubPublicFlist(config, username, source)
+    linkflist = HubPublicFlist(config, username, linkname)
+
+    if not flist.user_exists:
+        return api_response("user not found", 404)
+
+    if not flist.file_exists:
+        return api_response("source not found", 404)
+
+    # remove previous symlink if existing
+    if os.path.islink(linkflist.target):
+        os.unlink(linkflist.target)
+
+    # if it was not a link but a regular file, we don't overwrite
+    # existing flist, we only allows updating links
+    if os.path.isfile(linkflist.target):
+        return api_response("link destination is already a file", 401)
+
+    cwd = os.getcwd()
+    os.chdir(flist.user_path)
+
+    os.symlink(flist.filename, linkflist.filename)
+    os.chdir(cwd)
+
+    linkflist.updated()
+
+    return api_response()
+
+def api_cross_symlink(username, repository, sourcename, linkname):
+    flist = HubPublicFlist(config, repository, sourcename)
+    linkflist = HubPublicFlist(config, username, linkname)
+
+    if not flist.user_exists:
+        return api_response("source repository not found", 404)
+
+    if not flist.file_exists:
+        return api_response("source not found", 404)
+
+    # remove previous symlink if existing
+    if os.path.islink(linkflist.target):
+        os.unlink(linkflist.target)
+
+    # if it was not a link but a regular file, we don't overwrite
+    # existing flist, we only allows updating links
+    if os.path.isfile(linkflist.target):
+        return api_response("link destination is already a file", 401)
+
+    cwd = os.getcwd()
+    os.chdir(linkflist.user_path)
+
+    os.symlink("../" + flist.username + "/" + flist.filename, linkflist.filename)
+    os.chdir(cwd)
+
+    linkflist.updated()
+
+    return api_response()
+
+def api_promote(username, sourcerepo, sourcefile, targetname):
+    flist = HubPublicFlist(config, sourcerepo, sourcefile)
+    destination = HubPublicFlist(config, username, targetname)
+
+    if not flist.user_exists:
+        return api_response("user not found", 404)
+
+    if not flist.file_exists:
+        return api_response("source not found", 404)
+
+    # ensure target exists
+    if not destination.user_exists:
+        destination.user_create()
+
+    # remove previous file if existing
+    if os.path.exists(destination.target):
+        os.unlink(destination.target)
+
+    print("[+] promote: %s -> %s" % (flist.target, destination.target))
+    shutil.copy(flist.target, destination.target)
+    destination.updated()
+
+    status = {
+        'source': {
+            'username': flist.username,
+            'filename': flist.filename,
+        },
+        'destination': {
+            'username': destination.username,
+            'filename': destination.filename,
+        }
+    }
+
+    return api_response(extra=status)
+
+def api_flist_upload_receive(request, username):
+    """
+    Receive an uploaded archive (form field 'file'), the archive is hashed
+    and unpacked while the request body is still being received, it's
+    never stored on disk
+    """
+    received = {}
+
+    def opener(filename):
+        # only the first archive is unpacked
+        if received or not allowed_file(filename):
+            return None
+
+        filename = secure_filename(filename)
+
+        flist = HubPublicFlist(config, username, file_from_flist(filename), announcer)
+        workspace = flist.raw.workspace()
+
+        received['flist'] = flist
+        received['workspace'] = workspace
+        received['unpacker'] = flist.raw.unpacker(filename, workspace.name)
+
+        return received['unpacker']
+
+    receiver = HubStreamingReceiver(opener)
+    stage = hub.timing.HubStage('save')
+
+    try:
+        form, files = receiver.parse(request)
+
+    finally:
+        # body received (or connection lost), let tar finish
+        if 'unpacker' in received:
+            stage.files = 1
+            stage.read = received['unpacker'].received
+            received['flist'].raw.timing.end(stage)
+
+            hub.metrics.uploaded('stream', stage.read, stage.wall)
+
+            received['status'] = received['flist'].raw.unpacked(received['unpacker'])
+
+    # anything failing here comes from the request (missing or
+    # unsupported file, broken archive), not from the hub
+    def failed(message):
+        if 'workspace' in received:
+            received['workspace'].cleanup()
+
+        return {'status': 'error', 'message': message, 'code': 400}
+
+    # check if the post request has the file part
+    if 'file' not in files:
+        return failed('no file found')
+
+    file = files['file']
+
+    # if user does not select file, browser also
+    # submit a empty part without filename
+    if file.filename == '':
+        return failed('no file selected')
+
+    if not allowed_file(file.filename):
+        return failed('this file is not allowed')
+
+    # archive unpacked is not the one from 'file' field
+    if file.stream.sink is None:
+        return failed('only one archive can be uploaded')
+
+    if received['status'] != 0:
+        return failed(received['unpacker'].error or 'could not unpack archive')
+
+    digests = file.stream.digest.dump()
+    print("[+] upload received: %s, %d bytes, sha256 %s" % (file.filename, file.stream.digest.size, digests['sha256']))
+
+    return {
+        'status': 'success',
+        'flist': received['flist'],
+        'workspace': received['workspace'],
+        'digests': digests,
+    }
+
+def api_flist_upload(request, username, validate=False):
+    # it's a new flist, let's do the normal flow, the archive
+    # is unpacked on-the-fly from the uploaded stream
+    if not validate:
+        response = api_flist_upload_receive(request, username)
+        if response['status'] != 'success':
+            return response
+
+        flist = response['flist']
+        workspace = response['workspace']
+
+        # built by the jobs pool, like any other build, the
+        # request waits for it
+        def build():
+            try:
+                flist.user_create()
+
+                stats = flist.raw.create(workspace.name, flist.target)
+                flist.updated()
+
+            finally:
+                with flist.raw.timing.stage('cleanup') as stage:
+                    stage.files = flist.raw.usage(workspace.name)[0]
+                    workspace.cleanup()
+
+            return {'status': 'success', 'stats': stats}
+
+        job = jobs.submit(flist.raw.jobid, username, "upload", build)
+        if job is None:
+            workspace.cleanup()
+            return {'status': 'error', 'message': 'too many jobs queued, please try again later', 'code': 503}
+
+        job.wait()
+
+        if job.status == 'failed':
+            return {'status': 'error', 'message': job.error or 'could not build flist'}
+
+        return {
+            'status': 'success',
+            'flist': flist.filename,
+            'home': username,
+            'stats': job.result['stats'],
+            'digests': response['digests'],
+            'timing': flist.raw.timing.dump(),
+        }
+
+    # check if the post request has the file part
+    if 'file' not in request.files:
+        return {'status': 'error', 'message': 'no file found'}
+
+    file = request.files['file']
+
+    # if user does not select file, browser also
+    # submit a empty part without filename
+    if file.filename == '':
+        return {'status': 'error', 'message': 'no file selected'}
+
+    if not allowed_file(file.filename, validate):
+        return {'status': 'error', 'message': 'this file is not allowed'}
+
+    #
+    # processing the file
+    #
+    filename = secure_filename(file.filename)
+
+    cleanfilename = file_from_flist(filename)
+    flist = HubPublicFlist(config, username, cleanfilename)
+    flist.user_create()
+
+    # we have an existing flist and checking contents
+    # we don't need to create the flist, we just ensure the
+    # contents is on the backend
+    print("[+] saving file")
+    source = os.path.join(config['upload-directory'], filename)
+
+    with flist.raw.timing.stage('save') as stage:
+        file.save(source)
+        stage.files = 1
+        stage.written = os.path.getsize(source)
+
+    flist.loads(source)
+    stats = flist.validate()
+    if stats['response']['failure'] > 0:
+        os.unlink(source)
+        return {'status': 'error', 'message': 'unauthorized upload, contents is not fully present on backend'}
+
+    flist.commit()
+
+    # removing uploaded source file
+    os.unlink(source)
+
+    return {'status': 'success', 'flist': flist.filename, 'home': username, 'stats': stats, 'timing': flist.raw.timing.dump()}
+
+def api_flist_upload_prepare(request, username, validate=False):
+    # the uploaded stream is only available during the request,
+    # it's unpacked while received, the archive is never stored
+    response = api_flist_upload_receive(request, username)
+    if response['status'] != 'success':
+        return response
+
+    flist = response['flist']
+    workspace = response['workspace']
+    digests = response['digests']
+
+    def build():
+        info = flist.create(workspace)
+        info['digests'] = digests
+        return info
+
+    flist.raw.newtask()
+    print("[+] flist creation id: %s" % flist.raw.jobid)
+
+    job = jobs.submit(flist.raw.jobid, username, "upload", build)
+    if job is None:
+        announcer.terminate(flist.raw.jobid)
+        workspace.cleanup()
+        return {'status': 'error', 'message': 'too many jobs queued, please try again later'}
+
+    return {'status': 'success', 'jobid': flist.raw.jobid, 'digests': digests}
+
+    """
+    print(flist.raw.jobid)
+
+    flist.user_create()
+
+    # it's a new flist, let's do the normal flow
+    if not validate:
+        workspace = flist.raw.workspace()
+        flist.raw.unpack(source, workspace.name)
+        stats = flist.raw.create(workspace.name, flist.target)
+
+    # we have an existing flist and checking contents
+    # we don't need to create the flist, we just ensure the
+    # contents is on the backend
+    else:
+        flist.loads(source)
+        stats = flist.validate()
+        if stats['response']['failure'] > 0:
+            return {'status': 'error', 'message': 'unauthorized upload, contents is not fully present on backend'}
+
+        flist.commit()
+
+    # removing uploaded source file
+    os.unlink(source)
+
+    return {'status': 'success', 'flist': flist.filename, 'home': username, 'stats': stats, 'timing': {}}
+    """
+
+def api_repositories():
+    return catalog.repositories()
+
+def api_user_contents(username, userpath):
+    return catalog.contents(username)
+
+def api_fileslist():
+    return catalog.fileslist()
+
+
+def api_contents(flist):
+    flist.loads(flist.target)
+    contents = flist.contents()
+
+    return contents["response"]
+
+def api_flist_md(flist):
+    flist.loads(flist.target)
+    response = flist.allmetadata()
+
+    return response
+
+def api_flist_info(flist):
+    stat = os.lstat(flist.target)
+    file = os.path.basename(flist.target)
+
+    contents = {
+        'name': file,
+        'size': stat.st_size,
+        'updated': int(stat.st_mtime),
+        'type': 'regular',
+        'md5': flist.checksum,
+    }
+
+    if S_ISLNK(stat.st_mode):
+        target = os.readlink(flist.target)
+
+        contents['type'] = 'symlink'
+        contents['target'] = target
+        contents['size'] = 0
+
+    return contents
+
+def api_response(error=None, code=200, extra=None):
+    reply = {"status": "success"}
+
+    if error:
+        reply = {"status": "error", "message": error}
+
+    if extra:
+        reply['payload'] = extra
+
+    response = make_response(json.dumps(reply) + "\n", code)
+    response.headers["Content-Type"] = "application/json"
+    return response
+
+#
+# http caching, validators and 'cache-control' policy per kind of endpoint
+#
+def cached(response, kind, etag=None, modified=None, ranges=False):
+    """
+    Set validators (strong etag, modification time) and cache policy of
+    `kind` on `response`, without etag provided, it's computed from the
+    body. Response becomes a 304 (or a partial content for ranges)
+    depending on request conditional headers
+    """
+    if etag:
+        response.set_etag(etag)
+
+    elif not response.direct_passthrough:
+        response.add_etag()
+
+    if modified:
+        response.last_modified = modified
+
+    policy = config['cache-control'].get(kind)
+    if policy:
+        response.headers['Cache-Control'] = policy
+
+    if ranges:
+        return response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+
+    return response.make_conditional(request)
+
+def listing_response(name, builder):
+    """
+    Serve precomputed listing `name`, compressed when the client
+    accepts it
+    """
+    listing = listings.get(name, builder)
+    encoding, etag, body = listing.negotiate(request.accept_encodings)
+
+    response = make_response(body)
+    response.headers["Content-Type"] = "application/json"
+    response.headers["Vary"] = "Accept-Encoding"
+
+    if encoding != 'identity':
+        response.headers["Content-Encoding"] = encoding
+
+    return cached(response, 'listing', etag)
+
+#
+# paginated and filtered listings
+#
+pagination = ['cursor', 'limit', 'prefix', 'match', 'sort', 'order', 'repository']
+
+def pagination_requested():
+    return any(argument in request.args for argument in pagination)
+
+def listing_page(formatter):
+    """
+    One page of the catalog index, filtered and sorted from
+    query arguments, entries are formatted with `formatter`
+    """
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc')
+
+    if sort not in hub.catalog.sortkeys:
+        return api_response("invalid sort, expected: name, mtime or size", 400)
+
+    if order not in ['asc', 'desc']:
+        return api_response("invalid order, expected: asc or desc", 400)
+
+    try:
+        limit = int(request.args.get('limit', 100))
+
+    except ValueError:
+        return api_response("invalid limit", 400)
+
+    limit = max(1, min(limit, config['listing-page-size']))
+
+    cursor = None
+    if request.args.get('cursor'):
+        cursor = hub.catalog.decode_cursor(request.args.get('cursor'))
+        if cursor is None:
+            return api_response("invalid cursor", 400)
+
+    try:
+        page, following = catalog.search(sort, order, cursor, limit,
+            request.args.get('prefix'), request.args.get('match'), request.args.get('repository'))
+
+    except ValueError as e:
+        return api_response(str(e), 400)
+
+    output = {
+        'items': [formatter(user, entry) for user, entry in page],
+        'next': following,
+    }
+
+    response = make_response(json.dumps(output) + "\n")
+    response.headers["Content-Type"] = "application/json"
+
+    return cached(response, 'listing')
+
+def unchanged(kind, etag, modified=None):
+    """
+    Returns a 304 response if the client copy is still valid, this avoid
+    building the full response for nothing
+    """
+    response = cached(Response(), kind, etag, modified)
+    if response.status_code == 304:
+        return response
+
+    return None
+
+
+#
+# notification subsystem (server-sent event)
+#
+@blueprint.route('/listen/<id>', methods=['GET'])
+def listen(id):
+    print("[+] listening id: %s" % id)
+    heartbeat = config.get('notifier-heartbeat', 15)
+
+    # served by gevent workers (gunicorn.conf.py), a waiting stream is
+    # an idle greenlet, not a thread: blocking parts of builds pushing
+    # events are offloaded (hub.offload) and don't hold the loop
+    def stream(messages):
+        hub.metrics.listeners(1)
+
+        try:
+            # reconnection delay hint for the browser
+            yield "retry: 3000\n\n"
+
+            while True:
+                try:
+                    msg = messages.get(timeout=heartbeat)
+
+                except queue.Empty:
+                    # keep connection (and proxies) alive
+                    yield ": keepalive\n\n"
+                    continue
+
+                # reaching None means there is nothing more expected
+                # on this job, channel is kept for other subscribers
+                # and cleaned up later
+                if msg == None:
+                    return
+
+                yield msg
+
+        finally:
+            # job over or client gone
+            hub.metrics.listeners(-1)
+
+    # browser reconnecting sends the last event received
+    last = request.headers.get('Last-Event-ID')
+
+    messages = announcer.listen(id, last)
+    if messages == None:
+        return announcer.error("job id not found"), 404
+
+    response = Response(stream(messages), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+
+    return response
+
+
+######################################
+#
+# METRICS
+#
+######################################
+@blueprint.before_app_request
+def metrics_started():
+    g.started = time.monotonic()
+
+@blueprint.after_app_request
+def metrics_record(response):
+    if 'started' in g:
+        # route pattern, not the path, keeps labels bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        hub.metrics.request(route, request.method, response.status_code, time.monotonic() - g.started)
+
+    return response
+
+@blueprint.route('/metrics', methods=['GET'])
+def metrics():
+    if not config['metrics'] or not hub.metrics.enabled():
+        abort(404)
+
+    data, contenttype = hub.metrics.expose()
+
+    response = make_response(data)
+    response.headers['Content-Type'] = contenttype
+    response.headers['Cache-Control'] = 'no-store'
+
+    return response
+
+######################################
+#
+# APPLICATION FACTORY
+#
+######################################
+def defaults(config):
+    """
+    Runtime configuration, theses location should works
+    out-of-box if you use default settings
+    """
+    if not 'userdata-root-path' in config:
+        config['userdata-root-path'] = os.path.join(rootpath, "../public")
+
+    if not 'workdir-root-path' in config:
+        config['workdir-root-path'] = os.path.join(rootpath, "../workdir")
+
+    if not 'public-directory' in config:
+        config['public-directory'] = os.path.join(config['userdata-root-path'], "users")
+
+    if not 'flist-work-directory' in config:
+        config['flist-work-directory'] = os.path.join(config['workdir-root-path'], "temp")
+
+    if not 'docker-work-directory' in config:
+        config['docker-work-directory'] = os.path.join(config['workdir-root-path'], "temp")
+
+    if not 'docker-layers-directory' in config:
+        config['docker-layers-directory'] = os.path.join(config['workdir-root-path'], "layers")
+
+    if not 'docker-index' in config:
+        config['docker-index'] = os.path.join(config['workdir-root-path'], "dockers.json")
+
+    if not 'docker-layers-cache' in config:
+        config['docker-layers-cache'] = True
+
+    if not 'upload-directory' in config:
+        config['upload-directory'] = os.path.join(config['workdir-root-path'], "distfiles")
+
+    if not 'checksum-index' in config:
+        config['checksum-index'] = os.path.join(config['workdir-root-path'], "checksums.sqlite3")
+
+    if not 'flist-cache-directory' in config:
+        config['flist-cache-directory'] = os.path.join(config['workdir-root-path'], "cache")
+
+    if not 'allowed-extensions' in config:
+        config['allowed-extensions'] = ['.tar.gz', '.tgz', '.tar.zst', '.tar.xz', '.txz', '.tar.bz2', '.tbz2']
+
+    if not 'authentication' in config:
+        config['authentication'] = True
+
+    # maximum entries per listing page
+    if not 'listing-page-size' in config:
+        config['listing-page-size'] = 1000
+
+    # prometheus metrics endpoint (needs prometheus_client)
+    if not 'metrics' in config:
+        config['metrics'] = True
+
+    # flists can be replaced with the same name, clients keeps their
+    # copy but needs to revalidate it (etag) before using it
+    config['cache-control'] = dict({
+        'flist': 'public, no-cache',
+        'flist-info': 'public, no-cache',
+        'contents': 'public, no-cache',
+        'listing': 'public, max-age=30',
+    }, **config.get('cache-control', {}))
+
+    print("[+] user  directory : %s" % config['userdata-root-path'])
+    print("[+] works directory : %s" % config['workdir-root-path'])
+    print("[+] upload directory: %s" % config['upload-directory'])
+    print("[+] flist creation  : %s" % config['flist-work-directory'])
+    print("[+] docker creation : %s" % config['docker-work-directory'])
+    print("[+] docker layers   : %s" % config['docker-layers-directory'])
+    print("[+] public directory: %s" % config['public-directory'])
+    print("[+] checksum index  : %s" % config['checksum-index'])
+    print("[+] flists cache    : %s" % config['flist-cache-directory'])
+
+def create_app(settings):
+    """
+    Build the hub application from `settings` (config.py), background
+    services (jobs, catalog watcher, reaper) are started in the calling
+    process, this needs to be called after forking (one per worker)
+    """
+    global config, announcer, jobs, catalog, listings, uploads, reaper
+
+    config = settings
+    defaults(config)
+
+    #
+    # pre-check settings
+    # checking configuration settings needed for runtime
+    #
+    hc = HubFlist(config)
+    if not hc.check():
+        print("[-] pre-check: your local configuration seems not correct")
+        print("[-] pre-check: please check config.py settings and backend status")
+        raise RuntimeError("hub pre-check failed")
+
+    #
+    # initialize flask application
+    #
+    app = Flask(__name__, root_path=rootpath)
+    # app.wsgi_app = hub.itsyouonline.ItsYouChecker(app.wsgi_app)
+    app.wsgi_app = ProxyFix(app.wsgi_app)
+    app.url_map.strict_slashes = False
+
+    # sessions needs to be readable by all workers
+    app.secret_key = config.get('secret-key') or os.urandom(24)
+
+    # notifications
+    announcer = hub.notifier.create(config)
+
+    # build jobs scheduler
+    jobs = HubJobs(config)
+    jobs.start()
+
+    # repositories and flists listing
+    catalog = hub.catalog.shared(config)
+    catalog.watch()
+
+    # serialized and compressed public listings
+    listings = HubListings(catalog)
+
+    # resumable uploads sessions
+    uploads = HubUploads(config)
+
+    # stale channels, workspaces and uploads cleanup
+    reaper = HubReaper(config, announcer)
+    reaper.start()
+
+    if config['authentication']:
+        hub.itsyouonline.configure(app,
+            config['iyo-clientid'], config['iyo-secret'], config['iyo-callback'],
+            '/_iyo_callback', None, True, True, 'organization', config['guest-token']
+        )
+
+        hub.threebot.configure(app, config['threebot-appid'], config['threebot-privatekey'])
+
+    else:
+        hub.itsyouonline.disabled(app)
+        config['official-repositories'] = ['Administrator']
+
+        print("[-] -- WARNING -------------------------------------")
+        print("[-]                                                 ")
+        print("[-]             AUTHENTICATION DISABLED             ")
+        print("[-]       FULL CONTROL IS ALLOWED FOR ANYBODY       ")
+        print("[-]                                                 ")
+        print("[-] This mode should be _exclusively_ used in local ")
+        print("[-] development  or  private environment,  never in ")
+        print("[-] public  production  environment,  except if you ")
+        print("[-] know what you're doing                          ")
+        print("[-]                                                 ")
+        print("[-] -- WARNING -------------------------------------")
+
+    app.register_blueprint(blueprint)
+
+    return app
@@ -0,0 +1,153 @@
+import os
+import threading
+import collections
+import contextlib
+import hub.registry
+
+class HubFlistSession:
+    def __init__(self, flist, signature):
+        self.flist = flist
+        self.signature = signature
+        self.users = 0
+        self.stale = False
+
+class HubFlistSessions:
+    """
+    Pool of long-lived opened flists
+
+    zflist keeps an opened flist in its mountpoint (ZFLIST_MNT) until
+    'close' is called, read-only commands (find, stat, metadata) can
+    be executed again and again on the same mountpoint. Keeping recently
+    used flists opened saves the 'open' and 'close' processes (which
+    extract and cleanup the whole database) on each inspection request.
+
+    Sessions are keyed by flist real path and are reopened when the
+    file changes on disk (inode, size or mtime)
+    """
+    def __init__(self, config, factory):
+        self.config = config
+        self.factory = factory
+        self.maxsize = config.get('zflist-sessions', 16)
+        self.lock = threading.Lock()
+        self.sessions = collections.OrderedDict()
+
+    def signature(self, path):
+        stat = os.stat(path)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def touch(self, session):
+        # keep mountpoint of a long-lived session away from the reaper
+        try:
+            os.utime(session.flist.workdir)
+
+        except FileNotFoundError:
+            pass
+
+    def refresh(self):
+        """
+        Touch mountpoints of all pooled sessions, reapers of any
+        process sharing the work directory keep them
+        """
+        with self.lock:
+            sessions = list(self.sessions.values())
+
+        for session in sessions:
+            self.touch(session)
+
+    def release(self, session):
+        # needs to be called with lock held, returns True
+        # when the session needs to be closed
+        session.users -= 1
+        return session.stale and session.users == 0
+
+    def discard(self, path):
+        # needs to be called with lock held, returns the
+        # session when it needs to be closed
+        session = self.sessions.pop(path)
+        session.stale = True
+
+        return session if session.users == 0 else None
+
+    def close(self, sessions):
+        # closing runs zflist, never called with lock held
+        for session in sessions:
+            if session is None or not session.flist.opened:
+                continue
+
+            print("[+] session: closing %s" % session.flist.source)
+            session.flist.close()
+
+    def acquire(self, source):
+        path = os.path.realpath(source)
+        signature = self.signature(path)
+        closing = []
+
+        with self.lock:
+            if path in self.sessions:
+                # mountpoint removed meanwhile, reopen it
+                live = os.path.isdir(self.sessions[path].flist.workdir)
+
+                if live and self.sessions[path].signature == signature:
+                    self.sessions.move_to_end(path)
+                    self.sessions[path].users += 1
+                    self.touch(self.sessions[path])
+                    return self.sessions[path]
+
+                closing.append(self.discard(path))
+
+        self.close(closing)
+        closing = []
+
+        # opening is slow, don't hold the pool meanwhile
+        flist = self.factory(self.config)
+        flist.loads(path)
+        flist.open()
+
+        session = HubFlistSession(flist, signature)
+        session.users += 1
+
+        if not flist.opened:
+            print("[-] session: could not open %s" % path)
+
+            # not pooled, commands will open it (again) themselves
+            session.stale = True
+            return session
+
+        with self.lock:
+            # someone else opened it meanwhile, keep only one
+            if path in self.sessions:
+                closing.append(self.discard(path))
+
+            self.sessions[path] = session
+
+            while len(self.sessions) > self.maxsize:
+                closing.append(self.discard(next(iter(self.sessions))))
+
+        self.close(closing)
+
+        return session
+
+    @contextlib.contextmanager
+    def use(self, source):
+        """
+        Yields an opened HubFlist for `source`, shared with other
+        readers, which must not be closed or modified
+        """
+        session = self.acquire(source)
+
+        try:
+            yield session.flist
+
+        finally:
+            with self.lock:
+                unused = self.release(session)
+
+            if unused:
+                self.close([session])
+
+def shared(config, factory):
+    return hub.registry.instance(HubFlistSessions, factory, lambda: HubFlistSessions(config, factory))
+
+def refresh():
+    for pool in hub.registry.everyone(HubFlistSessions):
+        pool.refresh()
@@ -0,0 +1,113 @@
+import os
+import time
+import resource
+import threading
+import contextlib
+import hub.metrics
+
+def cputime():
+    """
+    Cpu time used by the hub process and its terminated subprocesses
+    (tar, decoders, zflist), there is no per-thread accounting for
+    subprocesses: concurrent builds are accounted to each other
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def usage(rootdir):
+    """
+    Amount of files and bytes stored under `rootdir`
+    """
+    files = 0
+    size = 0
+
+    for root, dirs, names in os.walk(rootdir):
+        for name in names:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+
+            except FileNotFoundError:
+                continue
+
+            files += 1
+            size += stat.st_size
+
+    return files, size
+
+class HubStage:
+    """
+    Instrumentation of one build stage, started when created
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0
+        self.cpu = 0
+        self.read = 0
+        self.written = 0
+        self.files = 0
+        self.extra = {}
+
+        self.started = time.monotonic()
+        self.cpustart = cputime()
+
+    def stop(self):
+        self.wall = time.monotonic() - self.started
+        self.cpu = cputime() - self.cpustart
+
+    def dump(self):
+        entry = {
+            'wall': round(self.wall, 3),
+            'cpu': round(self.cpu, 3),
+            'read': self.read,
+            'written': self.written,
+            'files': self.files,
+        }
+
+        entry.update(self.extra)
+        return entry
+
+class HubTiming:
+    """
+    Per-stage instrumentation of one build (save, unpack, putdir, readme,
+    commit, pull, export, cleanup), a stage running more than once
+    (eg: cleanup) is accumulated
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def end(self, stage):
+        stage.stop()
+        hub.metrics.stage(stage)
+
+        with self.lock:
+            found = self.stages.get(stage.name)
+
+            if found is None:
+                self.stages[stage.name] = stage
+                return stage
+
+            found.wall += stage.wall
+            found.cpu += stage.cpu
+            found.read += stage.read
+            found.written += stage.written
+            found.files += stage.files
+            found.extra.update(stage.extra)
+
+        return found
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stage = HubStage(name)
+
+        try:
+            yield stage
+
+        finally:
+            self.end(stage)
+
+    def dump(self):
+        with self.lock:
+            return {name: stage.dump() for name, stage in self.stages.items()}
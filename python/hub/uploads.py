@@ -0,0 +1,333 @@
+import os
+import json
+import uuid
+import fcntl
+import time
+import hashlib
+import threading
+import hub.metrics
+import hub.offload
+from werkzeug.formparser import FormDataParser
+
+class HubDigest:
+    """
+    md5 and sha256 of some data, updated as it goes through
+    """
+    def __init__(self):
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def update(self, data):
+        self.md5.update(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+    def dump(self):
+        return {'md5': self.md5.hexdigest(), 'sha256': self.sha256.hexdigest()}
+
+class HubStreamingFile:
+    """
+    Writable file object given to the form parser in place of a
+    temporary file, uploaded data is hashed and forwarded to `sink`
+    (or dropped without sink) as soon as it's received
+    """
+    def __init__(self, filename, sink=None):
+        self.filename = filename
+        self.sink = sink
+        self.digest = HubDigest()
+        self.broken = False
+
+    def write(self, data):
+        self.digest.update(data)
+
+        # reader stopped early (eg: invalid archive), keep
+        # consuming request body, error is reported later
+        if self.sink is not None and not self.broken:
+            try:
+                self.sink.write(data)
+
+            except BrokenPipeError:
+                self.broken = True
+
+        return len(data)
+
+    # parser rewinds the file when the part is complete
+    def seek(self, offset, whence=0):
+        return 0
+
+    def read(self, size=-1):
+        return b""
+
+    def close(self):
+        pass
+
+class HubStreamingReceiver:
+    """
+    Parse a multipart upload without storing file parts: `opener` is
+    called with the filename of each file part when it starts and
+    returns where its data is forwarded (None to drop it)
+    """
+    def __init__(self, opener):
+        self.opener = opener
+        self.files = []
+
+    def factory(self, total_content_length, content_type, filename, content_length=None):
+        container = HubStreamingFile(filename, self.opener(filename))
+        self.files.append(container)
+
+        return container
+
+    def parse(self, request):
+        """
+        Consume `request` body, returns form and files (the FileStorage
+        stream of each file is its HubStreamingFile)
+        """
+        parser = FormDataParser(self.factory)
+        stream, form, files = parser.parse(request.stream, request.mimetype, request.content_length, request.mimetype_params)
+
+        return form, files
+
+class HubUploadSession:
+    """
+    One resumable upload, the archive is assembled in place in the
+    upload directory (`<id>.part`), received ranges and owner are kept
+    next to it (`<id>.json`) so an upload can be resumed after a
+    dropped connection or a restart
+    """
+    def __init__(self, root, sessionid):
+        self.id = sessionid
+        self.partfile = os.path.join(root, "%s.part" % sessionid)
+        self.metafile = os.path.join(root, "%s.json" % sessionid)
+        self.lock = threading.Lock()
+
+        # digests are computed as contiguous data arrives
+        self.hashes = HubDigest()
+
+    def load(self):
+        with open(self.metafile, "r") as f:
+            return json.load(f)
+
+    def save(self, meta):
+        temp = self.metafile + ".tmp"
+
+        with open(temp, "w") as f:
+            f.write(json.dumps(meta))
+
+        os.rename(temp, self.metafile)
+
+    def update(self, start, end):
+        """
+        Mark range [start, end) as received, returns updated metadata
+        """
+        # other workers can receive chunks of the same upload, the
+        # archive file is used as lock (metadata file is replaced)
+        with open(self.partfile, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            meta = self.load()
+            meta['ranges'] = merge(meta['ranges'] + [[start, end]])
+            self.save(meta)
+
+        return meta
+
+    def claim(self, jobid):
+        """
+        Flag the upload as finalized by `jobid` (or no job with None),
+        returns updated metadata, the upload is only claimed by `jobid`
+        if no other job did first
+        """
+        with open(self.partfile, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            meta = self.load()
+
+            if jobid is None or not meta.get('jobid'):
+                meta['jobid'] = jobid
+                self.save(meta)
+
+        return meta
+
+    def received(self, meta):
+        return sum(end - start for start, end in meta['ranges'])
+
+    def complete(self, meta):
+        return meta['ranges'] == [[0, meta['size']]]
+
+    def digest(self, meta):
+        """
+        Hash newly contiguous data, from where hashing stopped, data was
+        just written and is read back from page cache
+        """
+        with self.lock:
+            contiguous = meta['ranges'][0][1] if meta['ranges'] and meta['ranges'][0][0] == 0 else 0
+
+            if contiguous <= self.hashes.size:
+                return
+
+            hub.offload.run(self.catchup, contiguous)
+
+    def catchup(self, contiguous):
+        # needs to be called with lock held
+        with open(self.partfile, "rb") as f:
+            f.seek(self.hashes.size)
+            remain = contiguous - self.hashes.size
+
+            while remain > 0:
+                data = f.read(min(remain, 1 << 20))
+                if not data:
+                    break
+
+                self.hashes.update(data)
+                remain -= len(data)
+
+    def digests(self, meta):
+        # chunks received by another process (or before a restart)
+        # were not hashed here, catch up from the file
+        self.digest(meta)
+
+        return self.hashes.dump()
+
+    def write(self, stream, start, end):
+        """
+        Write request `stream` at `start`, returns amount of bytes written
+        """
+        offset = start
+        fd = os.open(self.partfile, os.O_WRONLY)
+
+        try:
+            while offset < end:
+                data = stream.read(min(end - offset, 1 << 20))
+                if not data:
+                    break
+
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+
+        finally:
+            os.close(fd)
+
+        return offset - start
+
+    def remove(self):
+        for filename in [self.partfile, self.metafile]:
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+class HubUploads:
+    """
+    Resumable chunked uploads
+
+    An upload session is created with the final archive size, chunks
+    are then sent in any order (and in parallel) with their byte range.
+    When every byte was received, the session can be finalized and the
+    archive built like a regular upload
+    """
+    def __init__(self, config):
+        self.root = config['upload-directory']
+        self.maxchunk = config.get('upload-chunk-size', 64 << 20)
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def create(self, username, filename, size):
+        session = HubUploadSession(self.root, uuid.uuid4().hex)
+
+        meta = {
+            'id': session.id,
+            'username': username,
+            'filename': filename,
+            'size': size,
+            'ranges': [],
+        }
+
+        with open(session.partfile, "wb") as f:
+            f.truncate(size)
+
+        session.save(meta)
+
+        with self.lock:
+            self.sessions[session.id] = session
+
+        return meta
+
+    def get(self, sessionid, username):
+        """
+        Returns session and its metadata, None if the session doesn't
+        exists or doesn't belong to `username`
+        """
+        # session ids are generated hex strings, nothing else is a path
+        if not sessionid or not all(c in "0123456789abcdef" for c in sessionid):
+            return None, None
+
+        with self.lock:
+            session = self.sessions.get(sessionid)
+
+            if session is None:
+                session = HubUploadSession(self.root, sessionid)
+                self.sessions[sessionid] = session
+
+            # finalized elsewhere or reaped
+            if not os.path.exists(session.metafile):
+                self.sessions.pop(sessionid)
+                return None, None
+
+        meta = session.load()
+        if meta['username'] != username:
+            return None, None
+
+        return session, meta
+
+    def status(self, session, meta):
+        return {
+            'id': session.id,
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'received': session.received(meta),
+            'ranges': meta['ranges'],
+            'complete': session.complete(meta),
+            'chunk-size': self.maxchunk,
+        }
+
+    def receive(self, session, meta, stream, start, end):
+        """
+        Store range [start, end) read from `stream`, a range is only
+        recorded when fully received
+        """
+        if start < 0 or end > meta['size'] or start >= end:
+            raise ValueError("range outside of upload size")
+
+        if end - start > self.maxchunk:
+            raise ValueError("chunk too large (maximum %d bytes)" % self.maxchunk)
+
+        started = time.monotonic()
+
+        if session.write(stream, start, end) != end - start:
+            raise ValueError("incomplete chunk received")
+
+        hub.metrics.uploaded('chunk', end - start, time.monotonic() - started)
+
+        meta = session.update(start, end)
+        session.digest(meta)
+
+        return meta
+
+    def remove(self, session):
+        with self.lock:
+            self.sessions.pop(session.id, None)
+
+        session.remove()
+
+#
+# ranges are kept sorted and merged: [[0, 10], [10, 20]] is [[0, 20]]
+#
+def merge(ranges):
+    merged = []
+
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+            continue
+
+        merged.append([start, end])
+
+    return merged
@@ -55,6 +55,31 @@ function flists(files, username) {
     }
 }
 
+function searchresults(page, append) {
+    if(!append)
+        $("#entries tbody").empty();
+
+    $(".loading").hide();
+
+    for(var index in page['items']) {
+        var item = page['items'][index];
+        var repository = item['repository'];
+
+        var username = $('<td>').append($('<a>', {'href': repository}).html(repository));
+
+        var filepath = repository + "/" + item['name'] + '.md';
+        var filename = $('<td>').append($('<a>', {'href': filepath}).html(item['name']));
+        var size = $('<td>').html(item['size']);
+
+        var tr = $('<tr>')
+            .append(username)
+            .append(filename)
+            .append(size);
+
+        $('#entries tbody').append(tr);
+    }
+}
+
 function uswitch(username) {
     Cookies.set('active-user', username);
     $(".current-user").html(username);
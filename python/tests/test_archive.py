@@ -0,0 +1,60 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import tarfile
+import hub.archive
+from hub.archive import HubStreamDecompressor, HubArchiveUnpacker
+
+def archive(files=20):
+    buffer = io.BytesIO()
+
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for index in range(files):
+            data = os.urandom(4096)
+            info = tarfile.TarInfo("file-%d" % index)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    return buffer.getvalue()
+
+def streams(data, compress):
+    # two concatenated streams, like pigz or pbzip2 outputs
+    half = len(data) // 2
+    return compress(data[:half]), compress(data[half:])
+
+def decompress(compression, chunks):
+    decompressor = HubStreamDecompressor(compression)
+    return b"".join(decompressor.decompress(chunk) for chunk in chunks)
+
+def test_stream_ending_on_write_boundary():
+    data = archive()
+
+    for compression, compress in [("bzip2", bz2.compress), ("gzip", gzip.compress), ("xz", lzma.compress)]:
+        first, second = streams(data, compress)
+        assert decompress(compression, [first, second]) == data
+
+def test_signature_split_across_writes():
+    data = archive()
+
+    for compression, compress in [("bzip2", bz2.compress), ("gzip", gzip.compress), ("xz", lzma.compress)]:
+        first, second = streams(data, compress)
+
+        for split in range(1, len(hub.archive.formats[compression]['magic'])):
+            chunks = [first + second[:split], second[split:]]
+            assert decompress(compression, chunks) == data
+
+def test_python_fallback_unpacks_split_streams(tmp_path, monkeypatch):
+    monkeypatch.setattr(hub.archive, "decoder", lambda compression: None)
+
+    data = archive()
+    first, second = streams(data, bz2.compress)
+
+    unpacker = HubArchiveUnpacker(str(tmp_path))
+    unpacker.write(first)
+    unpacker.write(second)
+
+    assert unpacker.close() == 0
+    assert unpacker.decoder == "python"
+    assert len(os.listdir(tmp_path)) == 20
@@ -0,0 +1,10 @@
+from config import config
+from hub.server import create_app
+
+#
+# production entry point, with cooperative (gevent) workers, idle
+# connections (server-sent events listeners) don't hold any thread
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+app = create_app(config)
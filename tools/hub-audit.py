@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import tempfile
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+rootpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../python")
+sys.path.insert(0, rootpath)
+
+from config import config
+from hub.flist import HubFlist
+from hub.backend import HubBackend
+
+#
+# flists reachability audit
+#
+# every flist of the public directory is opened to collect its chunks
+# keys, keys shared between flists are only checked once against the
+# backend, then each flist is reported with its amount of missing chunks
+#
+class HubAudit:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.flists = {}
+        self.keys = set()
+        self.failed = []
+        self.local = threading.local()
+
+        self.config = dict(config)
+        self.config['checksum-index'] = ":memory:"
+        self.config['flist-work-directory'] = args.workdir
+
+        self.backend = HubBackend(args.host, args.port, args.password, args.batch)
+
+    def walk(self):
+        for user in sorted(os.listdir(self.args.public)):
+            userpath = os.path.join(self.args.public, user)
+            if not os.path.isdir(userpath):
+                continue
+
+            for name in sorted(os.listdir(userpath)):
+                filepath = os.path.join(userpath, name)
+
+                # links points to an flist audited anyway
+                if os.path.islink(filepath) or not name.endswith(".flist"):
+                    continue
+
+                yield "%s/%s" % (user, name), filepath
+
+    def collect(self, item):
+        name, filepath = item
+
+        flist = HubFlist(self.config)
+        flist.loads(filepath)
+        keys = flist.chunks()
+
+        with self.lock:
+            if keys is None:
+                self.failed.append(name)
+                return
+
+            keys = [bytes.fromhex(key) for key in keys]
+            self.flists[name] = keys
+            self.keys.update(keys)
+
+    def check(self, batch):
+        # one connection per checker thread
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = self.backend.connect()
+
+        return self.backend.exists(batch, self.local.conn)
+
+    def run(self):
+        items = list(self.walk())
+        print("[+] audit: %d flists found" % len(items), file=sys.stderr)
+
+        # keep zflist verbosity away from the report
+        with contextlib.redirect_stdout(sys.stderr):
+            with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+                list(executor.map(self.collect, items))
+
+        total = sum(len(keys) for keys in self.flists.values())
+        print("[+] audit: %d chunks, %d unique keys" % (total, len(self.keys)), file=sys.stderr)
+
+        keys = list(self.keys)
+        size = self.args.batch * 16
+        batches = [keys[i:i + size] for i in range(0, len(keys), size)]
+
+        missing = set()
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            for found in executor.map(self.check, batches):
+                missing.update(found)
+
+        print("[+] audit: %d keys missing on backend" % len(missing), file=sys.stderr)
+
+        return self.report(missing)
+
+    def report(self, missing):
+        report = {}
+
+        for name, keys in sorted(self.flists.items()):
+            lost = [key for key in keys if key in missing]
+            report[name] = {'chunks': len(keys), 'missing': len(lost)}
+
+            if self.args.details:
+                report[name]['keys'] = [key.hex() for key in lost]
+
+        for name in self.failed:
+            report[name] = {'error': 'could not read flist chunks'}
+
+        if self.args.json:
+            print(json.dumps(report))
+
+        else:
+            for name, entry in sorted(report.items()):
+                if 'error' in entry:
+                    print("%-60s  ERROR  %s" % (name, entry['error']))
+                    continue
+
+                status = "OK" if entry['missing'] == 0 else "BROKEN"
+                print("%-60s  %-6s  %d/%d chunks missing" % (name, status, entry['missing'], entry['chunks']))
+
+        broken = [name for name, entry in report.items() if entry.get('missing', 1) > 0]
+        return len(broken)
+
+def arguments():
+    public = config.get('public-directory', os.path.join(rootpath, "../public/users"))
+
+    parser = argparse.ArgumentParser(description="flists backend reachability audit")
+    parser.add_argument("--public", default=public, help="hub public directory (users repositories)")
+    parser.add_argument("--host", default=config['backend-internal-host'], help="0-db host")
+    parser.add_argument("--port", default=config['backend-internal-port'], type=int, help="0-db port")
+    parser.add_argument("--password", default=config['backend-internal-pass'], help="0-db password")
+    parser.add_argument("--workers", default=8, type=int, help="amount of parallel flists readers and checkers")
+    parser.add_argument("--batch", default=1024, type=int, help="keys per pipelined round-trip")
+    parser.add_argument("--workdir", default=tempfile.gettempdir(), help="temporary directory used to open flists")
+    parser.add_argument("--details", action="store_true", help="include missing keys on the report")
+    parser.add_argument("--json", action="store_true", help="json report")
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    audit = HubAudit(arguments())
+    sys.exit(1 if audit.run() > 0 else 0)
@@ -1,34 +1,287 @@
+import os
 import redis
 import sys
+import time
+import queue
+import argparse
+import threading
 
-# r = redis.Redis("10.241.0.232", 9901)
-r = redis.Redis("62.150.178.136", 9901)
-info = redis.client.parse_info(r.execute_command("NSINFO minio"))
+#
+# 0-db namespace integrity checker
+#
+# keys are walked with SCANX, each batch is checked by one of the
+# workers with pipelined CHECK commands (one round-trip per batch)
+#
+# progression (scan cursor) is saved on a checkpoint file, which
+# allows to resume an interrupted check, keys which failed the check
+# are written (hex encoded) to an errors file
+#
+class RateLimiter:
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.allowance = rate
+        self.last = time.monotonic()
 
-entries = info['entries']
-print("Keys: %d" % entries)
-print("Starting integrity checking...")
+    def wait(self, amount):
+        if not self.rate:
+            return
 
-checked = 0
-nextkey = ""
-errors = []
+        # allowance can go negative (batch larger than rate or concurrent
+        # callers), each caller then sleeps until its own debt is paid
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + ((now - self.last) * self.rate))
+            self.last = now
+            self.allowance -= amount
 
-response = r.execute_command("SCANX")
+            delay = -self.allowance / self.rate if self.allowance < 0 else 0
 
-while True:
-    for key in response[1]:
-        if r.execute_command("CHECK", key[0]) == 0:
-            errors.append(key[0])
+        if delay > 0:
+            time.sleep(delay)
 
-    checked += len(response[1])
+class IntegrityChecker:
+    def __init__(self, args):
+        self.args = args
+        self.limiter = RateLimiter(args.rate)
+        self.batches = queue.Queue(maxsize=args.workers * 4)
+        self.lock = threading.Lock()
 
-    sys.stdout.write("\rIntegrity check: %.02f %% [%d/%d, %d errors]" % (((checked / entries) * 100), checked, entries, len(errors)))
+        self.checked = 0
+        self.errors = 0
+        self.entries = 0
 
-    if response[0] is None:
-        break
+        # scan order of batches, to checkpoint only fully checked ones
+        self.sequence = 0
+        self.pending = {}
+        self.done = set()
+        self.cursor = None
+        self.finished = False
 
-    response = r.execute_command("SCANX", response[0])
+        # scanner or checker failures, the check stops at the first one
+        self.failures = []
 
-print("")
-print("Integrity check done, errors: %d" % len(errors))
-print(errors)
+        self.errfile = open(args.errors, "a")
+
+    def connect(self):
+        r = redis.Redis(self.args.host, self.args.port, password=self.args.password or None, single_connection_client=True)
+
+        if self.args.namespace != "default":
+            if self.args.nspass:
+                r.execute_command("SELECT", self.args.namespace, self.args.nspass)
+
+            else:
+                r.execute_command("SELECT", self.args.namespace)
+
+        return r
+
+    def nsinfo(self, r):
+        info = {}
+        response = r.execute_command("NSINFO", self.args.namespace)
+
+        for line in response.decode('utf-8').splitlines():
+            key, _, value = line.partition(":")
+            info[key.strip()] = value.strip()
+
+        return info
+
+    def restore(self):
+        try:
+            with open(self.args.checkpoint, "r") as f:
+                cursor = f.read().strip()
+
+        except FileNotFoundError:
+            return None
+
+        if not cursor:
+            return None
+
+        print("[+] resuming from checkpoint: %s" % cursor)
+        return bytes.fromhex(cursor)
+
+    def checkpoint(self):
+        # needs to be called with lock held
+        if self.cursor is None:
+            return
+
+        temp = self.args.checkpoint + ".tmp"
+        with open(temp, "w") as f:
+            f.write(self.cursor.hex())
+
+        os.rename(temp, self.args.checkpoint)
+
+    def scan(self, r, cursor):
+        try:
+            if cursor is None:
+                return r.execute_command("SCANX")
+
+            return r.execute_command("SCANX", cursor)
+
+        except redis.exceptions.ResponseError as e:
+            # end of namespace reached
+            if "No more data" in str(e):
+                return None
+
+            raise
+
+    def failed(self, where, error):
+        with self.lock:
+            self.failures.append("%s: %s" % (where, error))
+
+    def scanner(self):
+        try:
+            self.scanning()
+
+        except Exception as e:
+            self.failed("scanner", e)
+
+        finally:
+            for i in range(self.args.workers):
+                self.batches.put(None)
+
+    def scanning(self):
+        r = self.connect()
+        cursor = self.restore()
+
+        while not self.failures:
+            response = self.scan(r, cursor)
+            if response is None:
+                self.finished = True
+                break
+
+            keys = [key[0] for key in response[1]]
+            cursor = response[0]
+
+            with self.lock:
+                sequence = self.sequence
+                self.pending[sequence] = cursor
+                self.sequence += 1
+
+            self.batches.put((sequence, keys))
+
+            if cursor is None:
+                self.finished = True
+                break
+
+    def completed(self, sequence, failed, amount):
+        with self.lock:
+            self.checked += amount
+            self.errors += len(failed)
+
+            for key in failed:
+                self.errfile.write("%s\n" % key.hex())
+
+            self.done.add(sequence)
+
+            # move checkpoint forward, up to the first batch still in progress
+            while len(self.pending) > 0:
+                first = min(self.pending.keys())
+                if first not in self.done:
+                    break
+
+                self.cursor = self.pending.pop(first)
+                self.done.discard(first)
+
+    def check(self, r, sequence, keys):
+        self.limiter.wait(len(keys))
+
+        pipe = r.pipeline(transaction=False)
+        for key in keys:
+            pipe.execute_command("CHECK", key)
+
+        results = pipe.execute(raise_on_error=False)
+        failed = [key for key, result in zip(keys, results) if result != 1]
+
+        self.completed(sequence, failed, len(keys))
+
+    def worker(self):
+        r = None
+
+        while True:
+            item = self.batches.get()
+            if item is None:
+                return
+
+            # after a failure, batches are only drained (scanner stops),
+            # they stay pending and the checkpoint doesn't move past them
+            if self.failures:
+                continue
+
+            try:
+                if r is None:
+                    r = self.connect()
+
+                self.check(r, *item)
+
+            except Exception as e:
+                self.failed("checker (batch %d)" % item[0], e)
+
+    def progress(self):
+        with self.lock:
+            percent = ((self.checked / self.entries) * 100) if self.entries else 0
+            sys.stdout.write("\rIntegrity check: %.02f %% [%d/%d, %d errors]" % (percent, self.checked, self.entries, self.errors))
+            sys.stdout.flush()
+
+            self.checkpoint()
+            self.errfile.flush()
+
+    def run(self):
+        r = self.connect()
+        info = self.nsinfo(r)
+        self.entries = int(info['entries'])
+
+        print("Keys: %d" % self.entries)
+        print("Starting integrity checking (%d workers)..." % self.args.workers)
+
+        workers = [threading.Thread(target=self.worker, daemon=True) for i in range(self.args.workers)]
+        for worker in workers:
+            worker.start()
+
+        scanner = threading.Thread(target=self.scanner, daemon=True)
+        scanner.start()
+
+        while any(worker.is_alive() for worker in workers):
+            self.progress()
+            time.sleep(self.args.interval)
+
+        self.progress()
+        self.errfile.close()
+
+        print("")
+
+        if self.failures or not self.finished or len(self.pending) > 0:
+            for failure in self.failures:
+                print("[-] %s" % failure)
+
+            start = self.cursor.hex() if self.cursor is not None else "beginning of namespace"
+            print("[-] integrity check incomplete, keys after cursor %s were not (all) checked" % start)
+            print("[-] run again to resume from checkpoint (%s), errors so far: %d" % (self.args.checkpoint, self.errors))
+
+            return False
+
+        print("Integrity check done, errors: %d (see %s)" % (self.errors, self.args.errors))
+
+        # full namespace checked, next run starts over
+        if os.path.exists(self.args.checkpoint):
+            os.unlink(self.args.checkpoint)
+
+        return self.errors == 0
+
+def arguments():
+    parser = argparse.ArgumentParser(description="0-db namespace integrity checker")
+    parser.add_argument("--host", default="127.0.0.1", help="0-db host")
+    parser.add_argument("--port", default=9900, type=int, help="0-db port")
+    parser.add_argument("--password", default="", help="0-db admin password")
+    parser.add_argument("--namespace", default="default", help="namespace to check")
+    parser.add_argument("--nspass", default="", help="namespace password")
+    parser.add_argument("--workers", default=4, type=int, help="amount of parallel checkers")
+    parser.add_argument("--rate", default=0, type=int, help="maximum keys checked per second (0: unlimited)")
+    parser.add_argument("--checkpoint", default="hub-integrity.checkpoint", help="resume cursor file")
+    parser.add_argument("--errors", default="hub-integrity.errors", help="failed keys file")
+    parser.add_argument("--interval", default=1, type=float, help="progress refresh interval (seconds)")
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    checker = IntegrityChecker(arguments())
+    sys.exit(0 if checker.run() else 1)